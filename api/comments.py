@@ -0,0 +1,330 @@
+"""
+This file contains the per-comment storage and expiry logic for community posts.
+
+Each comment is stored under its own id in a hash at `comments:<post_id>` (field = comment id, value = comment
+JSON), and every post has an expiry-ordered index (a sorted set at `comment_expiry:<post_id>`, member = comment
+id, score = expiry timestamp). Because comments are addressed by id, removing expired or excess comments is a
+HDEL/ZREM of those specific ids and can never overwrite a comment written concurrently. Reads only filter out
+expired comments; they never write. Expired comments are removed on the comment write paths and by
+`sweep_expired_comments`, which walks the indexes with SCAN. The number of live comments per post is capped,
+dropping the oldest first.
+
+Posts written before this schema keep their comments as a JSON list in the `comments` field of the post hash.
+They are still shown on reads and are moved into the new schema by `migrate_legacy_commands`, which only adds
+fields that are missing, so it is safe to repeat and to run alongside the app.
+
+The Redis helpers take a `run_pipeline` callable that sends a list of commands to the Upstash pipeline endpoint
+and returns the list of results.
+
+"""
+
+from datetime import datetime
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from api.constants import (
+    COMMENT_DEFAULT_TTL, COMMENT_HASH_PREFIX, COMMENT_INDEX_PREFIX, COMMENT_SWEEP_LOCK_KEY, TRENDING_KEY,
+    TRENDING_WRITE_ATTEMPTS,
+)
+from api.trending import parse_created_at, trending_score
+
+
+def comment_index_key(post_key: str) -> str:
+    """
+    Return the key of the expiry index for the post stored at `post_key` (`post:<id>`).
+    """
+    return f"{COMMENT_INDEX_PREFIX}{post_key.split(':', 1)[1]}"
+
+
+def comment_hash_key(post_key: str) -> str:
+    """
+    Return the key of the hash holding the comments of the post stored at `post_key` (`post:<id>`).
+    """
+    return f"{COMMENT_HASH_PREFIX}{post_key.split(':', 1)[1]}"
+
+
+def load_comments(raw) -> list:
+    """
+    Parse a legacy `comments` field, tolerating missing values and the `{"comments": "[...]"}` wrapper.
+    """
+    try:
+        comments = json.loads(raw) if raw else []
+        if isinstance(comments, dict):
+            comments = json.loads(comments.get("comments") or "[]")
+    except (TypeError, ValueError):
+        return []
+    return [comment for comment in comments if isinstance(comment, dict)] if isinstance(comments, list) else []
+
+
+def load_comment_hash(raw_hgetall) -> list:
+    """
+    Parse a flat HGETALL result of a comment hash into a list of comments, skipping unreadable entries.
+    """
+    comments = []
+    for value in (raw_hgetall or [])[1::2]:
+        try:
+            comment = json.loads(value)
+        except (TypeError, ValueError):
+            continue
+        if isinstance(comment, dict):
+            comments.append(comment)
+    return comments
+
+
+def comment_id(comment: dict) -> str:
+    """
+    Identify a comment inside its post; every comment gets a fresh random `author_id`.
+    """
+    return comment.get("author_id") or comment.get("timestamp", "")
+
+
+def normalize_ttl(ttl) -> int:
+    """
+    Return `ttl` as a positive number of seconds; missing or non-positive values get the default lifetime.
+    Raises ValueError for values that are not integers.
+    """
+    if ttl is None:
+        return COMMENT_DEFAULT_TTL
+    if isinstance(ttl, bool) or isinstance(ttl, float) and not ttl.is_integer():
+        raise ValueError(f"Invalid ttl: {ttl}")
+    try:
+        ttl = int(ttl)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid ttl: {ttl}")
+    return ttl if ttl > 0 else COMMENT_DEFAULT_TTL
+
+
+def comment_expires_at(comment: dict) -> float:
+    """
+    Epoch seconds at which a comment expires, derived from its `timestamp` and `ttl`.
+    """
+    try:
+        ttl = normalize_ttl(comment.get("ttl"))
+    except ValueError:
+        ttl = COMMENT_DEFAULT_TTL
+    return parse_created_at(comment.get("timestamp", "")) + ttl
+
+
+def split_expired(comments: list, now: float):
+    """
+    Split `comments` into (live, expired) lists at time `now`.
+    """
+    live, expired = [], []
+    for comment in comments:
+        (live if comment_expires_at(comment) > now else expired).append(comment)
+    return live, expired
+
+
+def live_comments(raw_comment_hash, raw_legacy, now: float) -> list:
+    """
+    Merge a post's stored and legacy comments and return the live ones, oldest first.
+    """
+    comments = {comment_id(comment): comment for comment in load_comments(raw_legacy)}
+    comments.update((comment_id(comment), comment) for comment in load_comment_hash(raw_comment_hash))
+    live, _ = split_expired(list(comments.values()), now)
+    return sorted(live, key=lambda comment: comment.get("timestamp", ""))
+
+
+def apply_cap(comments: list, max_live: int):
+    """
+    Keep the newest `max_live` of `comments` (ordered oldest first) and return (kept, dropped).
+    """
+    if max_live <= 0 or len(comments) <= max_live:
+        return comments, []
+    return comments[-max_live:], comments[:-max_live]
+
+
+def new_comment(content: str, author: str, author_id: str, ttl: int) -> dict:
+    """
+    Build a comment record timestamped now (naive UTC, like post `created_at`).
+    """
+    return {
+        "content": content,
+        "author": author,
+        "author_id": author_id,
+        "timestamp": datetime.utcnow().isoformat(),
+        "ttl": ttl,
+    }
+
+
+def store_commands(post_key: str, comments: list, post_ttl: int, only_missing: bool = False) -> list:
+    """
+    Build the commands that store `comments` under their ids, index their expiry and let both keys expire
+    with the post (`post_ttl` seconds, ignored when the post has no TTL). With `only_missing` existing
+    comments are left untouched.
+    """
+    hash_key, index_key = comment_hash_key(post_key), comment_index_key(post_key)
+    commands = []
+    for comment in comments:
+        if only_missing:
+            commands.append(["hsetnx", hash_key, comment_id(comment), json.dumps(comment)])
+            commands.append(["zadd", index_key, "NX", comment_expires_at(comment), comment_id(comment)])
+        else:
+            commands.append(["hset", hash_key, comment_id(comment), json.dumps(comment)])
+            commands.append(["zadd", index_key, comment_expires_at(comment), comment_id(comment)])
+    if comments and post_ttl and post_ttl > 0:
+        commands.append(["expire", hash_key, post_ttl])
+        commands.append(["expire", index_key, post_ttl])
+    return commands
+
+
+def migrate_legacy_commands(post_key: str, raw_legacy, post_ttl: int, now: float) -> list:
+    """
+    Build the commands that move a post's legacy `comments` list into the per-id schema.
+    """
+    live, _ = split_expired(load_comments(raw_legacy), now)
+    return store_commands(post_key, live, post_ttl, only_missing=True) + [["hdel", post_key, "comments", "comment_count"]]
+
+
+def removal_commands(post_key: str, ids: list) -> list:
+    """
+    Build the commands that remove the comments with the given ids; nothing else in the post is touched.
+    """
+    if not ids:
+        return []
+    return [["hdel", comment_hash_key(post_key), *ids], ["zrem", comment_index_key(post_key), *ids]]
+
+
+def live_count_command(post_key: str, now: float) -> list:
+    """
+    Command counting a post's live comments from its expiry index.
+    """
+    return ["zcount", comment_index_key(post_key), f"({now}", "+inf"]
+
+
+def score_input_commands(post_key: str, now: float) -> list:
+    """
+    Commands reading everything a post's trending score depends on; see `score_from_inputs`.
+    """
+    return [["hmget", post_key, "likes", "created_at", "comments"], live_count_command(post_key, now)]
+
+
+def score_from_inputs(inputs: list, now: float):
+    """
+    Compute a post's trending score from the results of `score_input_commands`, or None if the post is gone.
+    Comments still in a legacy list count as well, so scores do not drop when the list is migrated.
+    """
+    (likes, created_at, legacy), count = inputs[0] or [None] * 3, inputs[1]
+    if not created_at:
+        return None
+    live_legacy, _ = split_expired(load_comments(legacy), now)
+    return trending_score(likes or 0, (count or 0) + len(live_legacy), created_at)
+
+
+def write_trending_scores(run_pipeline, post_keys: list, now: float, inputs: list = None):
+    """
+    Write the trending score of the given posts from their current likes and live comments, adding posts that
+    are missing from the set (such as posts created before it existed).
+
+    Redis cannot compute the score itself, so each score is written and then checked: the inputs are read again
+    in the same pipeline right after the ZADD, and a score whose inputs changed meanwhile (a concurrent like or
+    comment) is rewritten. Whichever request writes last has therefore seen every change made before its check,
+    and the set never keeps a stale score. Posts that are gone are removed from the set. `inputs` holds the
+    results of `score_input_commands` for each post when the caller has already read them.
+    """
+    if inputs is None:
+        results = run_pipeline([command for key in post_keys for command in score_input_commands(key, now)])
+        inputs = [results[i:i + 2] for i in range(0, len(results), 2)]
+    pending = dict(zip(post_keys, inputs))
+
+    for _ in range(TRENDING_WRITE_ATTEMPTS):
+        commands, checks = [], []
+        for key, key_inputs in pending.items():
+            score = score_from_inputs(key_inputs, now)
+            if score is None:
+                commands.append(["zrem", TRENDING_KEY, key])
+                continue
+            commands.append(["zadd", TRENDING_KEY, score, key])
+            checks.append((key, score, len(commands)))
+            commands.extend(score_input_commands(key, now))
+        if not commands:
+            return
+        results = run_pipeline(commands)
+        pending = {}
+        for key, score, offset in checks:
+            if score_from_inputs(results[offset:offset + 2], now) != score:
+                pending[key] = results[offset:offset + 2]
+        if not pending:
+            return
+    logging.warning(f"Trending scores still changing after {TRENDING_WRITE_ATTEMPTS} writes: {', '.join(pending)}")
+
+
+def prune_posts(run_pipeline, post_keys: list, now: float) -> int:
+    """
+    Remove the expired comments of the given posts by id, and drop the comment keys of posts that are gone.
+    Returns the number of comments removed.
+    """
+    commands = []
+    for key in post_keys:
+        commands.append(["zrangebyscore", comment_index_key(key), "-inf", now])
+        commands.append(["exists", key])
+    results = run_pipeline(commands)
+
+    removals, live_posts, removed_total = [], [], 0
+    for key, expired_ids, exists in zip(post_keys, results[::2], results[1::2]):
+        if not exists:
+            # The post itself has expired or been deleted; its comment keys are orphaned
+            removals.append(["del", comment_hash_key(key), comment_index_key(key)])
+            continue
+        if expired_ids:
+            removals.extend(removal_commands(key, expired_ids))
+            live_posts.append(key)
+            removed_total += len(expired_ids)
+    if removals:
+        run_pipeline(removals)
+    if live_posts:
+        write_trending_scores(run_pipeline, live_posts, now)
+    return removed_total
+
+
+def sweep_expired_comments(run_pipeline, batch_size: int = 100) -> int:
+    """
+    Walk every comment expiry index with SCAN and prune posts that hold expired comments.
+    Returns the number of comments removed.
+    """
+    now = time.time()
+    removed_total = 0
+    cursor = "0"
+    while True:
+        cursor, index_keys = run_pipeline([["scan", cursor, "MATCH", f"{COMMENT_INDEX_PREFIX}*", "COUNT", batch_size]])[0]
+        if index_keys:
+            due = run_pipeline([["zrangebyscore", key, "-inf", now, "LIMIT", 0, 1] for key in index_keys])
+            post_keys = [f"post:{key[len(COMMENT_INDEX_PREFIX):]}" for key, ids in zip(index_keys, due) if ids]
+            if post_keys:
+                removed_total += prune_posts(run_pipeline, post_keys, now)
+        if str(cursor) == "0":
+            return removed_total
+
+
+def acquire_sweep_lock(run_pipeline, interval: float) -> bool:
+    """
+    Claim the sweep for the next `interval` seconds; only one of the workers racing for it succeeds.
+    """
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    return run_pipeline([["set", COMMENT_SWEEP_LOCK_KEY, owner, "NX", "EX", max(int(interval), 1)]])[0] == "OK"
+
+
+def start_comment_sweeper(run_pipeline, interval: float) -> threading.Thread:
+    """
+    Run `sweep_expired_comments` every `interval` seconds on a daemon thread.
+    Every worker starts one, but the shared lock lets only one of them sweep per interval.
+    """
+    def sweep_forever():
+        while True:
+            time.sleep(interval)
+            try:
+                if not acquire_sweep_lock(run_pipeline, interval):
+                    continue
+                removed = sweep_expired_comments(run_pipeline)
+                if removed:
+                    logging.info(f"Comment sweep removed {removed} expired comments")
+            except Exception as e:
+                logging.error(f"Error during comment sweep: {str(e)}")
+
+    thread = threading.Thread(target=sweep_forever, name="comment-sweeper", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,55 @@
+"""
+This file loads the application and serving settings from the environment (and `.env` when present).
+
+`load_config` is called by the app factory in `api/index.py`, so nothing is read from the environment at import
+time. The `SERVE_*` settings are only used by the production entry point in `api/serve.py`.
+
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+from api.constants import COMMENT_DEFAULT_MAX_LIVE
+
+
+def _int(name, default):
+    return int(os.getenv(name, default))
+
+
+def _float(name, default):
+    return float(os.getenv(name, default))
+
+
+def load_config() -> dict:
+    """
+    Read every setting from the environment, falling back to the defaults used on Vercel.
+    """
+    load_dotenv()
+    cpu_count = os.cpu_count() or 1
+    threads = _int("SERVE_THREADS", 8)
+    return {
+        # Flask / API
+        "MAX_CONTENT_LENGTH": _int("MAX_CONTENT_LENGTH", 16 * 1024 * 1024),  # 16MB max file size for uploads
+        "DOMAIN": os.getenv("DOMAIN", "https://ciphare.vercel.app"),
+        "UPSTASH_REDIS_URL": os.getenv("UPSTASH_REDIS_URL"),
+        "UPSTASH_REDIS_PASSWORD": os.getenv("UPSTASH_REDIS_PASSWORD"),
+        "UPSTASH_POOL_SIZE": _int("UPSTASH_POOL_SIZE", max(threads, 10)),  # Keep-alive connections per worker
+        "COMMENT_MAX_LIVE": _int("COMMENT_MAX_LIVE", COMMENT_DEFAULT_MAX_LIVE),
+        "COMMENT_SWEEP_INTERVAL": _float("COMMENT_SWEEP_INTERVAL", 0),  # 0 leaves pruning to comment writes
+
+        # Serving (api/serve.py)
+        "SERVE_BIND": os.getenv("SERVE_BIND", f"0.0.0.0:{os.getenv('PORT', 5000)}"),
+        "SERVE_WORKER_MODE": os.getenv("SERVE_WORKER_MODE", "thread"),  # thread, gevent or process
+        "SERVE_WORKERS": _int("SERVE_WORKERS", cpu_count),
+        "SERVE_THREADS": threads,
+        "SERVE_WORKER_CONNECTIONS": _int("SERVE_WORKER_CONNECTIONS", 1000),  # gevent only
+        "SERVE_KEEPALIVE": _int("SERVE_KEEPALIVE", 5),
+        "SERVE_TIMEOUT": _int("SERVE_TIMEOUT", 30),
+        "SERVE_GRACEFUL_TIMEOUT": _int("SERVE_GRACEFUL_TIMEOUT", 30),
+        "SERVE_MAX_REQUESTS": _int("SERVE_MAX_REQUESTS", 0),  # Recycle workers after N requests (0 disables)
+        "SERVE_MAX_REQUESTS_JITTER": _int("SERVE_MAX_REQUESTS_JITTER", 0),
+        "SERVE_LIMIT_REQUEST_LINE": _int("SERVE_LIMIT_REQUEST_LINE", 4094),
+        "SERVE_LIMIT_REQUEST_FIELD_SIZE": _int("SERVE_LIMIT_REQUEST_FIELD_SIZE", 8190),
+        "SERVE_PRELOAD": os.getenv("SERVE_PRELOAD", "1") not in ("0", "false", "False"),
+    }
@@ -2,3 +2,18 @@
 ID_LENGTH = 16
 ENCRYPTION_KEY_LENGTH = 16
 LATEST_KEY_VERSION = 2
+
+# Community trending feed
+TRENDING_KEY = "posts:trending"  # Sorted set of post keys ordered by trending score
+TRENDING_DECAY_SECONDS = 45000  # Every 12.5 hours a post's weight decays by a factor of e
+TRENDING_COMMENT_WEIGHT = 2  # A comment counts as much as two likes
+TRENDING_DEFAULT_LIMIT = 50  # Posts returned by /api/posts?sort=trending when no limit is given
+TRENDING_MAX_MEMBERS = 10000  # The set is trimmed to this many top-scored posts on every post creation
+TRENDING_WRITE_ATTEMPTS = 3  # Rewrites of a score whose inputs changed while it was being written
+
+# Community comments
+COMMENT_HASH_PREFIX = "comments:"  # Per-post hash of comment JSON keyed by comment id
+COMMENT_INDEX_PREFIX = "comment_expiry:"  # Per-post sorted set of comment ids ordered by expiry time
+COMMENT_DEFAULT_TTL = 90 * 24 * 60 * 60  # Default comment lifetime (90 days)
+COMMENT_SWEEP_LOCK_KEY = "comment-sweep-lock"  # Held for one sweep interval by the worker running the sweep
+COMMENT_DEFAULT_MAX_LIVE = 200  # Default cap on live comments per post; the oldest are dropped first
@@ -1,37 +1,63 @@
 from urllib.parse import urljoin, urlparse
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, current_app, request, jsonify
 from flask_cors import CORS
-from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from datetime import datetime
+from api.config import load_config
 from api.registry import EncryptionRegistry
 from api.utils import generate_id
+from api.trending import trending_score
+from api.comments import (
+    apply_cap, comment_hash_key, comment_id, comment_index_key, live_comments, load_comment_hash,
+    migrate_legacy_commands, new_comment, normalize_ttl, removal_commands, score_input_commands, split_expired,
+    start_comment_sweeper, store_commands, write_trending_scores,
+)
+from api.constants import TRENDING_KEY, TRENDING_DEFAULT_LIMIT, TRENDING_MAX_MEMBERS
 import base64
 import requests
 import os
 import json
 import logging
+import threading
+import time
 
-# Load environment variables
-load_dotenv()
+# Blueprint holding every API route; the app itself is built by create_app()
+api_bp = Blueprint("api", __name__)
 
-# Initialize Flask app
-app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Set 16MB max file size for uploads
-CORS(app, resources={r"/api/*": {"origins": "*"}}, methods=["GET", "POST", "DELETE"])
+# Per-process HTTP session for Upstash, recreated after a fork so workers never share sockets
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
 
-# Load Redis configurations
-UPSTASH_REDIS_URL = os.getenv("UPSTASH_REDIS_URL")
-UPSTASH_REDIS_PASSWORD = os.getenv("UPSTASH_REDIS_PASSWORD")
-HEADERS = {"Authorization": f"Bearer {UPSTASH_REDIS_PASSWORD}"}
+def upstash_session():
+    """
+    Return this process's keep-alive session for Upstash, creating it on first use after a fork.
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                pool_size = current_app.config["UPSTASH_POOL_SIZE"]
+                session = requests.Session()
+                session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+                session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+                _session, _session_pid = session, os.getpid()
+    return _session
+
+def redis_url():
+    return current_app.config["UPSTASH_REDIS_URL"]
+
+def redis_headers():
+    return {"Authorization": f"Bearer {current_app.config['UPSTASH_REDIS_PASSWORD']}"}
 
 # Helper functions
 def safe_request(method, endpoint_path, headers=None, data=None):
-    base_url = UPSTASH_REDIS_URL
+    base_url = redis_url()
     full_url = base_url + endpoint_path
     if method == "get":
-        return requests.get(full_url, headers=headers)
+        return upstash_session().get(full_url, headers=headers)
     elif method == "post":
-        return requests.post(full_url, headers=headers, json=data)
+        return upstash_session().post(full_url, headers=headers, json=data)
     raise ValueError(f"Unsupported HTTP method: {method}")
 
 def is_valid_base64(s: str) -> bool:
@@ -45,12 +71,12 @@ def add_padding(base64_string):
     return base64_string + "=" * (-len(base64_string) % 4)
 
 # Health check route
-@app.route("/")
+@api_bp.route("/")
 def health_check():
     return {"status": "running"}, 200
 
 # Encode API
-@app.route("/api/encode", methods=["POST"])
+@api_bp.route("/api/encode", methods=["POST"])
 def encode():
     """
     Handles file encryption and stores the result in Redis.
@@ -92,7 +118,7 @@ def encode():
         redis_pipeline.append(["expire", key, metadata["ttl"]])
 
         # Store encrypted data in Redis
-        response = requests.post(f"{UPSTASH_REDIS_URL}/pipeline", headers=HEADERS, json=redis_pipeline)
+        response = upstash_session().post(f"{redis_url()}/pipeline", headers=redis_headers(), json=redis_pipeline)
         logging.debug(f"Redis response: {response.text}")
 
         # Handle Redis errors
@@ -100,7 +126,7 @@ def encode():
             return jsonify({"error": "Failed to store encrypted data"}), 500
 
         # Generate and return shareable link
-        domain = os.getenv("DOMAIN", "https://ciphare.vercel.app")
+        domain = current_app.config["DOMAIN"]
         return jsonify({"file_id": file_id, "share_link": f"{domain}/decode/{file_id}"})
     except Exception as e:
         logging.error(f"Error during encoding: {str(e)}")
@@ -121,7 +147,7 @@ def add_padding(base64_string):
     return base64_string + "=" * (-len(base64_string) % 4)
 
 # Decode API
-@app.route("/api/decode", methods=["POST"])
+@api_bp.route("/api/decode", methods=["POST"])
 def decode():
     """
     Handles file decryption and retrieves the result from Redis.
@@ -142,7 +168,7 @@ def decode():
 
         # Fetch metadata from Redis
         key = f"cipher_share:{file_id}"
-        response = requests.get(f"{UPSTASH_REDIS_URL}/hgetall/{key}", headers=HEADERS)
+        response = upstash_session().get(f"{redis_url()}/hgetall/{key}", headers=redis_headers())
         logging.debug(f"Redis response for key {key}: {response.text}")
 
         if response.status_code != 200 or not response.json().get("result"):
@@ -177,14 +203,14 @@ def decode():
         # Update `reads` or delete if exhausted
         remaining_reads = metadata["reads"] - 1
         if remaining_reads > 0:
-            requests.post(
-                f"{UPSTASH_REDIS_URL}/hincrby/{key}/reads/-1",
-                headers=HEADERS
+            upstash_session().post(
+                f"{redis_url()}/hincrby/{key}/reads/-1",
+                headers=redis_headers()
             )
         else:
-            requests.post(
-                f"{UPSTASH_REDIS_URL}/del/{key}",
-                headers=HEADERS
+            upstash_session().post(
+                f"{redis_url()}/del/{key}",
+                headers=redis_headers()
             )
 
         # Return decrypted file data and metadata
@@ -202,7 +228,7 @@ def decode():
 # Safe request helper function to avoid SSRF vulnerabilities
 # Helper function for safe Redis requests
 def safe_request(method, endpoint_path, headers=None, data=None):
-    base_url = UPSTASH_REDIS_URL
+    base_url = redis_url()
     full_url = urljoin(base_url, endpoint_path)
     parsed_url = urlparse(full_url)
 
@@ -217,13 +243,81 @@ def safe_request(method, endpoint_path, headers=None, data=None):
 
     # Make the request
     if method == "get":
-        return requests.get(full_url, headers=HEADERS)
+        return upstash_session().get(full_url, headers=redis_headers())
     elif method == "post":
-        return requests.post(full_url, headers=HEADERS, data=data)
+        return upstash_session().post(full_url, headers=redis_headers(), data=data)
     else:
         raise ValueError(f"Unsupported HTTP method: {method}")
 
-@app.route("/api/posts", methods=["GET", "POST"])
+def run_pipeline(commands):
+    """
+    Send `commands` to the Upstash pipeline endpoint and return the list of results.
+    """
+    response = safe_request("post", "/pipeline", headers=redis_headers(), data=commands)
+    if response.status_code != 200:
+        raise RuntimeError(f"Redis pipeline failed with status {response.status_code}")
+    return [entry.get("result") for entry in response.json()]
+
+def parse_post(key, raw_post_data, raw_comments=None):
+    """
+    Convert the flat HGETALL results for a post and its comment hash into the dict returned by the API.
+    Expired comments are only filtered out here; removing them is left to the write paths and the sweep.
+    """
+    post_data = dict(zip(raw_post_data[::2], raw_post_data[1::2]))
+    post_data["_id"] = key.split(":")[1]
+    post_data["likes"] = int(post_data.get("likes", 0))
+    post_data["comments"] = live_comments(raw_comments, post_data.get("comments"), time.time())
+    post_data.pop("comment_count", None)
+    return post_data
+
+def read_posts(keys):
+    """
+    Fetch the given posts and their comments in one pipeline; posts that do not exist are returned as None.
+    """
+    commands = []
+    for key in keys:
+        commands.append(["hgetall", key])
+        commands.append(["hgetall", comment_hash_key(key)])
+    results = run_pipeline(commands)
+    # Hashes without `created_at` are half-written posts or leftovers of expired ones, not posts
+    return [
+        parse_post(key, raw_post_data, raw_comments) if "created_at" in raw_post_data[::2] else None
+        for key, raw_post_data, raw_comments in zip(keys, results[::2], results[1::2])
+    ]
+
+def get_trending_posts(limit):
+    """
+    Read the top `limit` posts straight from the trending sorted set.
+    Members are over-fetched and read page by page, so members whose post hash has expired do not leave fewer than
+    `limit` posts; they are removed from the set as they are encountered.
+    """
+    page_size = limit * 2
+    posts, stale_keys, seen, start = [], [], set(), 0
+    while len(posts) < limit:
+        response = safe_request("post", "/pipeline", headers=redis_headers(), data=[
+            ["zrevrange", TRENDING_KEY, start, start + page_size - 1]
+        ])
+        if response.status_code != 200:
+            return None
+        keys = [key for key in response.json()[0].get("result") or [] if key not in seen]
+        if not keys:
+            break
+        seen.update(keys)
+        for key, post in zip(keys, read_posts(keys)):
+            if post is None:
+                stale_keys.append(key)
+            elif len(posts) < limit:
+                posts.append(post)
+        start += page_size
+
+    if stale_keys:
+        try:
+            run_pipeline([["zrem", TRENDING_KEY, *stale_keys]])
+        except Exception as e:
+            logging.error(f"Error removing expired posts from the trending set: {str(e)}")
+    return posts
+
+@api_bp.route("/api/posts", methods=["GET", "POST"])
 def api_posts():
     if request.method == "POST":
         # Logic for creating a new post
@@ -244,119 +338,148 @@ def api_posts():
             "comments": []
         }
 
+        # Comments live in their own hash (see api/comments.py), created with the first comment
         redis_pipeline = [
             ["hset", key, "title", title],
             ["hset", key, "content", content],
             ["hset", key, "author", author],
             ["hset", key, "likes", 0],
             ["hset", key, "created_at", post_data["created_at"]],
-            ["hset", key, "comments", json.dumps([])],
-            ["expire", key, ttl]
+            ["expire", key, ttl],
+            ["zadd", TRENDING_KEY, trending_score(0, 0, post_data["created_at"]), key],
+            # Bound the set: members of posts that expired unseen sink to the bottom and are trimmed here
+            ["zremrangebyrank", TRENDING_KEY, 0, -(TRENDING_MAX_MEMBERS + 1)]
         ]
 
-        response = safe_request("post", "/pipeline", headers=HEADERS, data=redis_pipeline)
+        response = safe_request("post", "/pipeline", headers=redis_headers(), data=redis_pipeline)
         if response.status_code == 200:
             return jsonify({"message": "Post created successfully", "post_id": post_id}), 201
         return jsonify({"error": "Failed to create post"}), 500
 
     elif request.method == "GET":
+        # Trending posts are read directly from the sorted set maintained on writes
+        if request.args.get("sort") == "trending":
+            limit = max(1, min(request.args.get("limit", TRENDING_DEFAULT_LIMIT, type=int), 500))
+            try:
+                posts = get_trending_posts(limit)
+            except Exception as e:
+                logging.error(f"Error retrieving trending posts: {str(e)}")
+                posts = None
+            if posts is None:
+                return jsonify({"error": "Failed to retrieve posts"}), 500
+            return jsonify(posts), 200
+
         # Logic for retrieving all posts
-        response = safe_request("get", "/keys/post:*", headers=HEADERS)
+        response = safe_request("get", "/keys/post:*", headers=redis_headers())
         if response.status_code != 200:
             return jsonify({"error": "Failed to retrieve posts"}), 500
 
         keys = response.json().get("result", [])
-        posts = []
-
-        for key in keys:
-            post_response = safe_request("get", f"/hgetall/{key}", headers=HEADERS)
-            if post_response.status_code == 200:
-                raw_post_data = post_response.json().get("result", [])
-                post_data = dict(zip(raw_post_data[::2], raw_post_data[1::2]))
-                post_data["_id"] = key.split(":")[1]
-                post_data["likes"] = int(post_data.get("likes", 0))
-                post_data["comments"] = json.loads(post_data.get("comments", "[]"))
-                posts.append(post_data)
+        try:
+            posts = [post for post in read_posts(keys) if post is not None] if keys else []
+        except Exception as e:
+            logging.error(f"Error retrieving posts: {str(e)}")
+            return jsonify({"error": "Failed to retrieve posts"}), 500
 
         return jsonify(sorted(posts, key=lambda x: x["likes"], reverse=True)), 200
 
 
 # Route to like a post
-@app.route("/api/posts/<post_id>/like", methods=["POST"])
+@api_bp.route("/api/posts/<post_id>/like", methods=["POST"])
 def like_post(post_id):
     """
-    Increment the 'likes' field for a post in Redis.
+    Increment the 'likes' field for a post in Redis and refresh its trending score.
     """
     key = f"post:{post_id}"
     try:
-        response = safe_request("post", f"/hincrby/{key}/likes/1", headers=HEADERS)
-        if response.status_code == 200:
-            return jsonify({"message": "Post liked successfully"}), 200
-        return jsonify({"error": "Failed to like post"}), 500
+        # Check the post exists so HINCRBY never recreates an expired or deleted post
+        response = safe_request("post", "/pipeline", headers=redis_headers(), data=[["hexists", key, "created_at"]])
+        if response.status_code != 200:
+            return jsonify({"error": "Failed to like post"}), 500
+        if not response.json()[0].get("result"):
+            return jsonify({"error": "Post not found"}), 404
+
+        now = time.time()
+        redis_pipeline = [["hincrby", key, "likes", 1], *score_input_commands(key, now)]
+        response = safe_request("post", "/pipeline", headers=redis_headers(), data=redis_pipeline)
+        if response.status_code != 200:
+            return jsonify({"error": "Failed to like post"}), 500
+
+        inputs = [entry.get("result") for entry in response.json()[1:]]
+        if not (inputs[0] or [None] * 3)[1]:
+            # The post expired between the check and the increment; drop the `likes` field HINCRBY recreated
+            run_pipeline([["hdel", key, "likes"]])
+            return jsonify({"error": "Post not found"}), 404
+
+        write_trending_scores(run_pipeline, [key], now, [inputs])
+        return jsonify({"message": "Post liked successfully"}), 200
     except Exception as e:
         logging.error(f"Error liking post {post_id}: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 # Route to add a comment to a post
-@app.route("/<post_id>/comment", methods=["POST"])
+@api_bp.route("/<post_id>/comment", methods=["POST"])
 def add_comment(post_id):
     try:
         data = request.json
         content = data.get("content", "").strip()
         author = data.get("author", "Anonymous").strip()
-        ttl = data.get("ttl", 90 * 24 * 60 * 60)  # Default to 90 days in seconds
+        try:
+            ttl = normalize_ttl(data.get("ttl"))  # Default to 90 days in seconds
+        except ValueError:
+            return jsonify({"error": "ttl must be a whole number of seconds"}), 400
 
         if not content or not author:
             return jsonify({"error": "Author and content are required"}), 400
 
+        # Check the post exists so comments never recreate an expired or deleted post
         key = f"post:{post_id}"
-        response = safe_request("get", f"/hget/{key}/comments", headers=HEADERS)
-
+        index_key = comment_index_key(key)
+        response = safe_request("post", "/pipeline", headers=redis_headers(), data=[
+            ["hmget", key, "created_at", "comments"],
+            ["ttl", key]
+        ])
         if response.status_code != 200:
-            return jsonify({"error": "Failed to retrieve comments"}), 500
+            return jsonify({"error": "Failed to retrieve post"}), 500
 
-        # Ensure comments are parsed as a list
-        existing_comments = response.json().get("result", "[]")
-        try:
-            comments = json.loads(existing_comments)
-            if not isinstance(comments, list):
-                raise ValueError("Comments is not a list")
-        except Exception:
-            comments = []  # Reset to an empty list if parsing fails
+        (created_at, legacy_comments), post_ttl = [entry.get("result") for entry in response.json()]
+        if not created_at:
+            return jsonify({"error": "Post not found"}), 404
 
-        # Generate a unique ID for the comment's author
+        # Generate a unique ID for the comment's author, which also identifies the comment
         author_id = generate_id()
-
-        # Add the new comment
-        new_comment = {
-            "content": content,
-            "author": author,
-            "author_id": author_id,
-            "timestamp": datetime.utcnow().isoformat(),
-            "ttl": ttl,
-        }
-        comments.append(new_comment)
-
-        # Update comments in Redis
-        response = safe_request(
-            "post", f"/hset/{key}/comments", headers=HEADERS, data={"comments": json.dumps(comments)}
-        )
-
-        if response.status_code != 200:
-            return jsonify({"error": "Failed to add comment"}), 500
-
-        # Fetch the updated post data
-        post_response = safe_request("get", f"/hgetall/{key}", headers=HEADERS)
-        if post_response.status_code != 200:
-            return jsonify({"error": "Failed to retrieve updated post"}), 500
-
-        raw_post_data = post_response.json().get("result", [])
-        post_data = dict(zip(raw_post_data[::2], raw_post_data[1::2]))
-        post_data["_id"] = key.split(":")[1]
-        post_data["likes"] = int(post_data.get("likes", 0))
-        post_data["comments"] = json.loads(post_data.get("comments", "[]"))
+        comment = new_comment(content, author, author_id, ttl)
+
+        # Store the comment under its id, moving any legacy comment list over first so it counts towards the cap
+        now = time.time()
+        redis_pipeline = []
+        if legacy_comments is not None:
+            redis_pipeline.extend(migrate_legacy_commands(key, legacy_comments, post_ttl, now))
+        redis_pipeline.extend(store_commands(key, [comment], post_ttl))
+        redis_pipeline.append(["zrangebyscore", index_key, "-inf", now])
+        redis_pipeline.append(["hgetall", comment_hash_key(key)])
+        results = run_pipeline(redis_pipeline)
+
+        # Remove expired comments and the oldest ones beyond the per-post cap by id, then read the post back
+        comments, expired = split_expired(load_comment_hash(results[-1]), now)
+        comments.sort(key=lambda stored: stored.get("timestamp", ""))
+        _, dropped = apply_cap(comments, current_app.config["COMMENT_MAX_LIVE"])
+        dropped_ids = set(results[-2] or []) | {comment_id(stored) for stored in expired + dropped}
+        results = run_pipeline(removal_commands(key, sorted(dropped_ids)) + [
+            ["hgetall", key],
+            ["hgetall", comment_hash_key(key)],
+            *score_input_commands(key, now)
+        ])
+        raw_post_data, raw_comments = results[-4:-2]
+        if not raw_post_data:
+            return jsonify({"error": "Post not found"}), 404
+
+        post_data = parse_post(key, raw_post_data, raw_comments)
         post_data["created_at"] = post_data.get("created_at", "")
 
+        # Keep the trending score in step with the new comment
+        write_trending_scores(run_pipeline, [key], now, [results[-2:]])
+
         return jsonify(post_data), 200  # Return the updated post
 
     except Exception as e:
@@ -364,14 +487,17 @@ def add_comment(post_id):
 
 
 # Route to delete a post
-@app.route("/api/posts/<post_id>", methods=["DELETE"])
+@api_bp.route("/api/posts/<post_id>", methods=["DELETE"])
 def delete_post(post_id):
     """
     Delete a post from Redis.
     """
     key = f"post:{post_id}"
     try:
-        response = safe_request("post", f"/del/{key}", headers=HEADERS)
+        response = safe_request("post", "/pipeline", headers=redis_headers(), data=[
+            ["del", key, comment_hash_key(key), comment_index_key(key)],
+            ["zrem", TRENDING_KEY, key]
+        ])
         if response.status_code == 200:
             return jsonify({"message": "Post deleted successfully"}), 200
         return jsonify({"error": "Failed to delete post"}), 500
@@ -380,33 +506,41 @@ def delete_post(post_id):
         return jsonify({"error": str(e)}), 500
     
 # Route to delete a comment from a post
-@app.route("/<post_id>/comment/<int:comment_index>", methods=["DELETE"])
+@api_bp.route("/<post_id>/comment/<int:comment_index>", methods=["DELETE"])
 def delete_comment(post_id, comment_index):
     try:
         key = f"post:{post_id}"  # Define the key for Redis
 
         # Retrieve the existing comments
-        response = safe_request("get", f"/hget/{key}/comments", headers=HEADERS)  # Get the comments from Redis hash field
+        response = safe_request("post", "/pipeline", headers=redis_headers(), data=[
+            ["hmget", key, "created_at", "comments"],
+            ["ttl", key],
+            ["hgetall", comment_hash_key(key)]
+        ])
 
         if response.status_code != 200:
             print(f"Failed to retrieve comments. Redis Error: {response.status_code}, {response.text}")
             return jsonify({"error": "Failed to retrieve comments"}), 500
 
-        # Parse comments and remove the specified comment
-        comments = json.loads(response.json().get("result", "[]"))
+        # Parse comments, skipping expired ones so indexes match what readers were shown, and remove the specified comment
+        (created_at, legacy_comments), post_ttl, raw_comments = [entry.get("result") for entry in response.json()]
+        now = time.time()
+        comments = live_comments(raw_comments, legacy_comments, now)
         if 0 <= comment_index < len(comments):
-            deleted_comment = comments.pop(comment_index)
+            deleted_comment = comments[comment_index]
             print(f"Deleted comment: {deleted_comment}")
 
-            # Update the comments in Redis
-            response = safe_request(
-                "post",
-                f"/hset/{key}/comments",
-                headers=HEADERS,
-                data={"comments": json.dumps(comments)}
-            )
+            # Remove only that comment by id, after moving any legacy comment list over
+            redis_pipeline = []
+            if legacy_comments is not None:
+                redis_pipeline.extend(migrate_legacy_commands(key, legacy_comments, post_ttl, now))
+            redis_pipeline.extend(removal_commands(key, [comment_id(deleted_comment)]))
+            redis_pipeline.extend(score_input_commands(key, now))
+            response = safe_request("post", "/pipeline", headers=redis_headers(), data=redis_pipeline)
 
             if response.status_code == 200:
+                # Lower the trending score to match
+                write_trending_scores(run_pipeline, [key], now, [[entry.get("result") for entry in response.json()[-2:]]])
                 return jsonify({"message": "Comment deleted successfully"}), 200
             else:
                 print(f"Failed to delete comment. Redis Error: {response.status_code}, {response.text}")
@@ -418,9 +552,38 @@ def delete_comment(post_id, comment_index):
         print(f"Error in deleting comment: {e}")
         return jsonify({"error": "An error occurred while deleting the comment"}), 500
 
-# Vercel requires this for deployment
+def create_app(config=None):
+    """
+    Build the Flask app from the environment, with `config` overriding individual settings.
+    No per-process resources are created here so the app can be preloaded before forking workers.
+    """
+    app = Flask(__name__)
+    app.config.update(load_config())
+    app.config.update(config or {})
+    CORS(app, resources={r"/api/*": {"origins": "*"}}, methods=["GET", "POST", "DELETE"])
+    app.register_blueprint(api_bp)
+    return app
+
+def init_worker(app):
+    """
+    Set up the per-process resources for `app`: a fresh Upstash session and, when configured, the
+    background comment sweep (which runs in one worker at a time). Call it once in every worker after the fork.
+    """
+    global _session
+    _session = None
+
+    interval = app.config["COMMENT_SWEEP_INTERVAL"]
+    if interval > 0:
+        def run_in_app(commands):
+            with app.app_context():
+                return run_pipeline(commands)
+        start_comment_sweeper(run_in_app, interval)
+
+# Vercel and `flask run` use this module-level app
+app = create_app()
 handler = app
 
 if __name__ == "__main__":
+    init_worker(app)
     port = int(os.getenv("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,468 @@
+"""
+This file is the keyspace maintenance CLI for the share and post storage in Upstash Redis.
+
+It walks the keyspace with cursor-based SCAN (never KEYS), inspecting each batch of keys with a single pipeline,
+and reports per prefix (`cipher_share:`, `post:`, `comments:`, `comment_expiry:`, the trending set, everything
+else) the key count, memory, size and TTL histograms and the largest keys. It also detects:
+
+    - keys with no TTL (e.g. shares written by the legacy `api/store.py`, which skips EXPIRE when ttl <= 0,
+      or hashes recreated by HINCRBY after the original expired)
+    - orphans: share/post hashes without their payload, comment hashes, comment indexes and trending members
+      whose post is gone
+    - legacy entries: shares in the old url-safe base64 schema, and posts that still keep their comments
+      as a JSON list in the post hash or are missing from the trending set
+
+Nothing is written unless `--fix` is given, and fixes are throttled to `--fix-rate` commands per second (writes
+plus the reads legacy conversions need) while the scan itself is throttled to `--scan-rate` keys per second, so
+it can run against production. Orphans are only deleted if they are still incomplete when inspected again
+`--orphan-grace` seconds later, so a share or post caught halfway through its (non-atomic) write pipeline is
+never removed. A SCAN that fails raises instead of ending the walk early. Examples:
+
+    python -m api.keyspace report --json keyspace.json
+    python -m api.keyspace fix --fix ttl,orphans,legacy --fix-rate 20
+
+"""
+
+from collections import Counter
+import argparse
+import base64
+import heapq
+import json
+import sys
+import time
+
+import requests
+
+from api.comments import migrate_legacy_commands, score_from_inputs, score_input_commands
+from api.config import load_config
+from api.constants import COMMENT_HASH_PREFIX, COMMENT_INDEX_PREFIX, TRENDING_KEY
+
+SHARE_PREFIX = "cipher_share:"
+POST_PREFIX = "post:"
+PREFIXES = (SHARE_PREFIX, POST_PREFIX, COMMENT_HASH_PREFIX, COMMENT_INDEX_PREFIX, TRENDING_KEY)
+FIX_ACTIONS = ("ttl", "orphans", "legacy")
+
+DEFAULT_SHARE_TTL = 86400  # Same default as /api/encode
+DEFAULT_POST_TTL = 90 * 24 * 60 * 60  # Same default as /api/posts
+LEGACY_SHARE_FIELDS = ("encrypted_data", "iv", "tag", "salt")
+
+SIZE_BUCKETS = [(1024 * 4 ** i, label) for i, label in enumerate(("1KB", "4KB", "16KB", "64KB", "256KB", "1MB", "4MB", "16MB"))]
+TTL_BUCKETS = [(3600, "<1h"), (86400, "<1d"), (7 * 86400, "<7d"), (30 * 86400, "<30d"), (90 * 86400, "<90d")]
+
+
+class Upstash:
+    """
+    Minimal pipeline client for the Upstash REST API that keeps per-command errors instead of raising.
+    """
+
+    def __init__(self, url, token):
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def pipeline(self, commands):
+        if not commands:
+            return []
+        response = self.session.post(f"{self.url}/pipeline", json=commands)
+        response.raise_for_status()
+        return response.json()
+
+
+class RateLimiter:
+    """
+    Token bucket allowing `rate` operations per second (0 disables the limit).
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.allowance = rate
+        self.last = time.monotonic()
+
+    def wait(self, operations=1):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self.allowance = min(self.allowance + (now - self.last) * self.rate, self.rate)
+        self.last = now
+        self.allowance -= operations
+        if self.allowance < 0:
+            time.sleep(-self.allowance / self.rate)
+
+
+class PrefixStats:
+    """
+    Aggregated statistics for every key sharing a prefix.
+    """
+
+    def __init__(self, top):
+        self.keys = 0
+        self.bytes = 0
+        self.sizes = Counter()
+        self.ttls = Counter()
+        self.types = Counter()
+        self.largest = []
+        self.top = top
+
+    def add(self, key, kind, ttl, size):
+        self.keys += 1
+        self.bytes += size
+        self.types[kind] += 1
+        self.sizes[size_bucket(size)] += 1
+        self.ttls[ttl_bucket(ttl)] += 1
+        if self.top:
+            heapq.heappush(self.largest, (size, key))
+            if len(self.largest) > self.top:
+                heapq.heappop(self.largest)
+
+    def as_dict(self):
+        return {
+            "keys": self.keys,
+            "bytes": self.bytes,
+            "types": dict(self.types),
+            "size_histogram": ordered(self.sizes, [label for _, label in SIZE_BUCKETS] + [">16MB"]),
+            "ttl_histogram": ordered(self.ttls, ["none"] + [label for _, label in TTL_BUCKETS] + [">=90d"]),
+            "largest": [{"key": key, "bytes": size} for size, key in sorted(self.largest, reverse=True)],
+        }
+
+
+def ordered(counter, labels):
+    return {label: counter[label] for label in labels if counter[label]}
+
+
+def size_bucket(size):
+    for limit, label in SIZE_BUCKETS:
+        if size <= limit:
+            return label
+    return ">16MB"
+
+
+def ttl_bucket(ttl):
+    if ttl < 0:
+        return "none"
+    for limit, label in TTL_BUCKETS:
+        if ttl < limit:
+            return label
+    return ">=90d"
+
+
+def prefix_of(key):
+    for prefix in PREFIXES:
+        if key.startswith(prefix):
+            return prefix
+    return "other"
+
+
+def result(entry, default=None):
+    return default if "error" in entry else entry.get("result", default)
+
+
+def required(entry, command):
+    """
+    Return the result of a command the walk cannot continue without, raising on an error reply so a failed
+    SCAN never ends in a report that looks complete.
+    """
+    if "error" in entry:
+        raise RuntimeError(f"{command} failed: {entry['error']}")
+    return entry.get("result")
+
+
+def inspect_commands(key):
+    """
+    Commands sent for every scanned key: type, TTL, memory, a fallback size and the schema checks for its prefix.
+    """
+    commands = [["type", key], ["ttl", key], ["memory", "usage", key]]
+    prefix = prefix_of(key)
+    if prefix == SHARE_PREFIX:
+        commands += [["hstrlen", key, "encrypted_data"], ["hexists", key, "encrypted_data"], ["hexists", key, "file_type"]]
+    elif prefix == POST_PREFIX:
+        commands += [
+            ["hstrlen", key, "comments"], ["hexists", key, "created_at"], ["hexists", key, "comments"],
+            ["zscore", TRENDING_KEY, key],
+        ]
+    elif prefix == COMMENT_HASH_PREFIX:
+        commands += [["hlen", key], ["exists", f"{POST_PREFIX}{key[len(COMMENT_HASH_PREFIX):]}"]]
+    elif prefix == COMMENT_INDEX_PREFIX:
+        commands += [["zcard", key], ["exists", f"{POST_PREFIX}{key[len(COMMENT_INDEX_PREFIX):]}"]]
+    return commands
+
+
+def scan_keyspace(upstash, match, count, limiter):
+    """
+    Yield batches of keys from a full cursor-based SCAN.
+    """
+    cursor = "0"
+    while True:
+        cursor, keys = required(upstash.pipeline([["scan", cursor, "MATCH", match, "COUNT", count]])[0], "SCAN")
+        if keys:
+            limiter.wait(len(keys))
+            yield keys
+        if str(cursor) == "0":
+            return
+
+
+def classify(key, entries):
+    """
+    Turn the inspection replies for one key into (type, ttl, size, problems).
+    """
+    kind, ttl, memory = result(entries[0], "none"), result(entries[1], -2), result(entries[2])
+    extra = [result(entry) for entry in entries[3:]]
+    prefix = prefix_of(key)
+    if isinstance(memory, int):
+        size = memory
+    else:
+        # MEMORY USAGE is unavailable; fall back to the length of the field that dominates shares and posts
+        size = extra[0] if prefix in (SHARE_PREFIX, POST_PREFIX) and isinstance(extra[0], int) else 0
+    problems = []
+
+    if kind == "none":
+        return kind, ttl, size, problems  # Expired between SCAN and inspection
+    if ttl == -1 and prefix in (SHARE_PREFIX, POST_PREFIX, COMMENT_HASH_PREFIX, COMMENT_INDEX_PREFIX):
+        problems.append("ttl")
+    if prefix in (SHARE_PREFIX, POST_PREFIX) and kind != "hash":
+        problems.append("wrong_type")
+    elif prefix == SHARE_PREFIX:
+        if not extra[1]:
+            problems.append("orphan")
+        elif not extra[2]:
+            problems.append("legacy")
+    elif prefix == POST_PREFIX:
+        if not extra[1]:
+            problems.append("orphan")
+        elif extra[2] or extra[3] is None:
+            # Comments still in a JSON list, or missing from the trending set (created before it existed)
+            problems.append("legacy")
+    elif prefix in (COMMENT_HASH_PREFIX, COMMENT_INDEX_PREFIX) and not extra[1]:
+        problems.append("orphan")
+    return kind, ttl, size, problems
+
+
+def to_standard_base64(value):
+    """
+    Re-encode a url-safe base64 value (as written by `api/store.py`) in the standard alphabet used by /api/decode.
+    """
+    return base64.b64encode(base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))).decode()
+
+
+def ttl_fix(key, args):
+    default = {SHARE_PREFIX: args.default_share_ttl}.get(prefix_of(key), args.default_post_ttl)
+    return [["expire", key, default]]
+
+
+def delete_orphans(upstash, candidates, args, limiter):
+    """
+    Delete the orphan candidates `{key: monotonic time first seen}` that are still orphans when inspected again
+    at least `--orphan-grace` seconds later, and return how many were deleted.
+
+    Upstash pipelines are not atomic, so a share or post can be caught between its first and last HSET and look
+    like an orphan. The pipeline that writes it completes within milliseconds, though, so a hash that is still
+    incomplete after the grace period was left behind by a failed or expired write and nothing will complete it.
+    """
+    keys = list(candidates)
+    if not keys:
+        return 0
+    wait = max(candidates.values()) + args.orphan_grace - time.monotonic()
+    if wait > 0:
+        time.sleep(wait)
+
+    deleted = 0
+    for start in range(0, len(keys), args.count):
+        batch = keys[start:start + args.count]
+        per_key = [inspect_commands(key) for key in batch]
+        limiter.wait(sum(len(commands) for commands in per_key))
+        replies = upstash.pipeline([command for commands in per_key for command in commands])
+        offset, confirmed = 0, []
+        for key, commands in zip(batch, per_key):
+            if "orphan" in classify(key, replies[offset:offset + len(commands)])[3]:
+                confirmed.append(key)
+            offset += len(commands)
+        if confirmed:
+            limiter.wait(len(confirmed))
+            upstash.pipeline([["del", key] for key in confirmed])
+            deleted += len(confirmed)
+    return deleted
+
+
+def legacy_fix(upstash, key, ttl, args, limiter):
+    """
+    Build the commands converting one legacy share or post to the current schema.
+    Posts are migrated with HSETNX/ZADD NX into the per-id comment hash, so comments the app writes meanwhile are
+    never overwritten, and added to the trending set if missing. The reads of the legacy entry count against
+    `limiter`.
+    """
+    if prefix_of(key) == SHARE_PREFIX:
+        limiter.wait(1)
+        raw = result(upstash.pipeline([["hgetall", key]])[0], [])
+        fields = dict(zip(raw[::2], raw[1::2]))
+        if not fields or "file_type" in fields:
+            return []
+        converted = {name: to_standard_base64(fields[name]) for name in LEGACY_SHARE_FIELDS if name in fields}
+        converted.update({
+            "file_name": "unknown",
+            "file_type": "application/octet-stream",
+            "ttl": ttl if ttl > 0 else args.default_share_ttl,
+        })
+        return [["hset", key, *[item for pair in converted.items() for item in pair]]]
+
+    now = time.time()
+    reads = score_input_commands(key, now)
+    limiter.wait(len(reads))
+    inputs = [result(entry) for entry in upstash.pipeline(reads)]
+    score = score_from_inputs(inputs, now)
+    if score is None:
+        return []
+    raw_comments = inputs[0][2]
+    commands = [] if raw_comments is None else migrate_legacy_commands(key, raw_comments, ttl, now)
+    # NX: a score the app has written meanwhile is at least as fresh as this one
+    commands.append(["zadd", TRENDING_KEY, "NX", score, key])
+    return commands
+
+
+def trending_orphans(upstash, count, limiter):
+    """
+    Walk the trending set with ZSCAN and return the members whose post no longer exists.
+    """
+    orphans, cursor = [], "0"
+    while True:
+        cursor, items = required(upstash.pipeline([["zscan", TRENDING_KEY, cursor, "COUNT", count]])[0], "ZSCAN")
+        members = items[::2]
+        if members:
+            limiter.wait(len(members))
+            exists = upstash.pipeline([["exists", member] for member in members])
+            orphans.extend(member for member, entry in zip(members, exists) if not result(entry, 1))
+        if str(cursor) == "0":
+            return orphans
+
+
+def run(upstash, args):
+    scan_limiter, fix_limiter = RateLimiter(args.scan_rate), RateLimiter(args.fix_rate)
+    stats = {}
+    problems = {name: Counter() for name in ("ttl", "orphan", "legacy", "wrong_type")}
+    examples = {name: [] for name in problems}
+    fixed = Counter()
+    oversized = []
+    orphan_candidates = {}
+
+    for keys in scan_keyspace(upstash, args.match, args.count, scan_limiter):
+        per_key = [inspect_commands(key) for key in keys]
+        replies = upstash.pipeline([command for commands in per_key for command in commands])
+        fixes = []
+        offset = 0
+        for key, commands in zip(keys, per_key):
+            kind, ttl, size, found = classify(key, replies[offset:offset + len(commands)])
+            offset += len(commands)
+            if kind == "none":
+                continue
+            prefix = prefix_of(key)
+            stats.setdefault(prefix, PrefixStats(args.top)).add(key, kind, ttl, size)
+            if prefix == SHARE_PREFIX and size > args.oversize:
+                oversized.append({"key": key, "bytes": size})
+            for problem in found:
+                problems[problem][prefix] += 1
+                if len(examples[problem]) < args.examples:
+                    examples[problem].append(key)
+
+            if "orphan" in found and "orphans" in args.fix:
+                orphan_candidates.setdefault(key, time.monotonic())
+                continue
+            if "legacy" in found and "legacy" in args.fix:
+                fixes.append(("legacy", legacy_fix(upstash, key, ttl, args, fix_limiter)))
+            if "ttl" in found and "ttl" in args.fix:
+                fixes.append(("ttl", ttl_fix(key, args)))
+
+        for action, commands in fixes:
+            if commands:
+                fix_limiter.wait(len(commands))
+                upstash.pipeline(commands)
+                fixed[action] += 1
+
+    if orphan_candidates:
+        fixed["orphans"] += delete_orphans(upstash, orphan_candidates, args, fix_limiter)
+
+    if TRENDING_KEY in stats or args.match == "*":
+        orphan_members = trending_orphans(upstash, args.count, scan_limiter)
+        if orphan_members:
+            problems["orphan"][TRENDING_KEY + " members"] += len(orphan_members)
+            examples["orphan"].extend(orphan_members[:max(args.examples - len(examples["orphan"]), 0)])
+            if "orphans" in args.fix:
+                for start in range(0, len(orphan_members), args.count):
+                    batch = orphan_members[start:start + args.count]
+                    fix_limiter.wait(len(batch))
+                    upstash.pipeline([["zrem", TRENDING_KEY, *batch]])
+                    fixed["orphans"] += len(batch)
+
+    return {
+        "prefixes": {prefix: item.as_dict() for prefix, item in sorted(stats.items())},
+        "oversized_shares": sorted(oversized, key=lambda item: item["bytes"], reverse=True)[:args.top],
+        "problems": {name: dict(counts) for name, counts in problems.items()},
+        "examples": {name: keys for name, keys in examples.items() if keys},
+        "fixed": dict(fixed),
+        "dry_run": not args.fix,
+    }
+
+
+def print_report(report):
+    for prefix, item in report["prefixes"].items():
+        print(f"\n{prefix}  keys={item['keys']}  bytes={item['bytes']}  types={item['types']}")
+        print(f"  sizes: {item['size_histogram']}")
+        print(f"  ttls:  {item['ttl_histogram']}")
+        for entry in item["largest"]:
+            print(f"  {entry['bytes']:>12}  {entry['key']}")
+    if report["oversized_shares"]:
+        print(f"\nOversized shares: {len(report['oversized_shares'])}")
+        for entry in report["oversized_shares"]:
+            print(f"  {entry['bytes']:>12}  {entry['key']}")
+    print("\nProblems:")
+    for name, counts in report["problems"].items():
+        print(f"  {name:<11} {sum(counts.values()):>8}  {counts or ''}")
+    if report["dry_run"]:
+        print("\nDry run: nothing was changed (use `fix --fix ttl,orphans,legacy` to repair)")
+    else:
+        print(f"\nFixed: {report['fixed']}")
+
+
+def parse_actions(spec):
+    actions = {action.strip() for action in spec.split(",") if action.strip()}
+    unknown = actions - set(FIX_ACTIONS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown fix action(s) {', '.join(sorted(unknown))}, expected {', '.join(FIX_ACTIONS)}")
+    return actions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report on and repair the share/post keyspace in Upstash Redis")
+    parser.add_argument("command", choices=("report", "fix"))
+    parser.add_argument("--fix", type=parse_actions, default=set(), help=f"Comma-separated: {', '.join(FIX_ACTIONS)}")
+    parser.add_argument("--match", default="*", help="SCAN MATCH pattern")
+    parser.add_argument("--count", type=int, default=200, help="SCAN COUNT hint and pipeline batch size")
+    parser.add_argument("--scan-rate", type=float, default=2000, help="Max keys inspected per second (0 = unlimited)")
+    parser.add_argument("--fix-rate", type=float, default=50, help="Max fix commands per second, reads included (0 = unlimited)")
+    parser.add_argument("--orphan-grace", type=float, default=30,
+                        help="Seconds an orphan must stay incomplete before it is deleted")
+    parser.add_argument("--oversize", type=int, default=4 * 1024 * 1024, help="Report shares larger than this many bytes")
+    parser.add_argument("--default-share-ttl", type=int, default=DEFAULT_SHARE_TTL)
+    parser.add_argument("--default-post-ttl", type=int, default=DEFAULT_POST_TTL)
+    parser.add_argument("--top", type=int, default=10, help="Largest keys listed per prefix")
+    parser.add_argument("--examples", type=int, default=10, help="Example keys listed per problem")
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write the report as JSON here")
+    args = parser.parse_args(argv)
+
+    if args.command == "report":
+        args.fix = set()
+    elif not args.fix:
+        parser.error("fix requires --fix with at least one action")
+
+    config = load_config()
+    if not config["UPSTASH_REDIS_URL"]:
+        parser.error("UPSTASH_REDIS_URL is not set")
+    upstash = Upstash(config["UPSTASH_REDIS_URL"], config["UPSTASH_REDIS_PASSWORD"])
+
+    report = run(upstash, args)
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+This file is the production entry point for self-hosted deployments, serving the app with gunicorn.
+
+The app is built once in the master process (`preload_app`), so the heavy imports (Flask, cryptography and the
+registered encryption algorithms) are shared copy-on-write by every worker. The master freezes the garbage
+collector before forking so collections in the workers do not touch (and copy) those shared pages. Everything
+that must not cross a fork, such as the Upstash HTTP session and the comment sweep thread, is created per
+worker by `init_worker` once the worker has started. The sweep threads take a lock in Redis before each run, so
+only one worker sweeps per COMMENT_SWEEP_INTERVAL.
+
+Worker modes (SERVE_WORKER_MODE):
+    thread  - gthread workers with SERVE_THREADS threads each (default)
+    gevent  - gevent workers with SERVE_WORKER_CONNECTIONS greenlets each (requires `gevent`)
+    process - sync workers handling one request at a time
+
+All tuning is read from the environment by `api.config.load_config`. Run it from the repository root with:
+
+    python -m api.serve
+
+"""
+
+import gc
+import sys
+
+from api.config import load_config
+
+WORKER_CLASSES = {
+    "thread": "gthread",
+    "gevent": "gevent",
+    "process": "sync",
+}
+
+
+def gunicorn_options(config: dict) -> dict:
+    """
+    Translate the SERVE_* settings into gunicorn settings.
+    """
+    mode = config["SERVE_WORKER_MODE"]
+    if mode not in WORKER_CLASSES:
+        raise ValueError(f"Unsupported worker mode '{mode}', expected one of {', '.join(WORKER_CLASSES)}")
+    return {
+        "bind": config["SERVE_BIND"],
+        "worker_class": WORKER_CLASSES[mode],
+        "workers": config["SERVE_WORKERS"],
+        "threads": config["SERVE_THREADS"] if mode == "thread" else 1,
+        "worker_connections": config["SERVE_WORKER_CONNECTIONS"],
+        "keepalive": config["SERVE_KEEPALIVE"],
+        "timeout": config["SERVE_TIMEOUT"],
+        "graceful_timeout": config["SERVE_GRACEFUL_TIMEOUT"],
+        "max_requests": config["SERVE_MAX_REQUESTS"],
+        "max_requests_jitter": config["SERVE_MAX_REQUESTS_JITTER"],
+        "limit_request_line": config["SERVE_LIMIT_REQUEST_LINE"],
+        "limit_request_field_size": config["SERVE_LIMIT_REQUEST_FIELD_SIZE"],
+        "preload_app": config["SERVE_PRELOAD"],
+        "when_ready": when_ready,
+        "post_worker_init": post_worker_init,
+    }
+
+
+def when_ready(server):
+    # Move everything allocated while preloading out of the collector's reach before the workers fork
+    gc.collect()
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    from api.index import init_worker
+
+    # Runs after the gevent worker has monkey-patched, so per-worker resources use cooperative sockets
+    init_worker(worker.wsgi)
+
+
+def main():
+    config = load_config()
+    if config["SERVE_WORKER_MODE"] == "gevent":
+        # Patch before the app (and requests/urllib3) is imported in the master
+        from gevent import monkey
+        monkey.patch_all()
+
+    from gunicorn.app.base import BaseApplication
+    from api.index import create_app
+
+    class CiphareApplication(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return create_app()
+
+    CiphareApplication(gunicorn_options(config)).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
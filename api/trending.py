@@ -0,0 +1,36 @@
+"""
+This file contains the scoring used for the community "trending" feed.
+
+Each post gets a score of the form log(weight) + created_at / decay, where the weight combines likes and
+comments. Because the age term is fixed at creation time, a post's score only changes when its own likes or
+comments change, so the ranking is kept in a Redis sorted set that is updated incrementally and never needs
+a global recomputation: every unit of decay that passes is equivalent to all older posts losing a factor of e
+in weight relative to newer ones.
+
+"""
+
+from datetime import datetime, timezone
+import math
+
+from api.constants import TRENDING_COMMENT_WEIGHT, TRENDING_DECAY_SECONDS
+
+
+def parse_created_at(created_at: str) -> float:
+    """
+    Convert a post's `created_at` ISO timestamp (stored as naive UTC) into epoch seconds.
+    """
+    try:
+        created = datetime.fromisoformat(created_at)
+    except (TypeError, ValueError):
+        return 0.0
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    return created.timestamp()
+
+
+def trending_score(likes: int, comment_count: int, created_at: str) -> float:
+    """
+    Compute the log-space trending score of a post from its likes, comment count and creation time.
+    """
+    weight = max(int(likes) + TRENDING_COMMENT_WEIGHT * int(comment_count), 1)
+    return math.log(weight) + parse_created_at(created_at) / TRENDING_DECAY_SECONDS
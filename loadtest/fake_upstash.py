@@ -0,0 +1,449 @@
+"""
+This file provides a small in-memory stand-in for the Upstash Redis REST API, used by the load-test harness.
+
+It speaks the same wire format as Upstash: commands are sent either as a path (`GET /hgetall/<key>`), as a path
+with the POST body appended as the last argument (`POST /hset/<key>/<field>`), as a JSON array posted to `/`, or as
+a list of JSON arrays posted to `/pipeline`. Replies are `{"result": ...}` or `{"error": ...}` objects.
+
+Only the commands used by the app and the maintenance tooling are implemented. A configurable latency (plus
+jitter) is injected into every HTTP request so the app can be measured against a realistic network round trip.
+
+Run it on its own with:
+
+    python -m loadtest.fake_upstash --port 8079 --latency-ms 5
+
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+import argparse
+import fnmatch
+import json
+import random
+import threading
+import time
+
+
+class CommandError(Exception):
+    """Raised for a command the fake cannot execute, reported back as an Upstash `error` reply."""
+
+
+class FakeRedis:
+    """
+    A thread-safe in-memory keyspace holding strings, hashes, sets and sorted sets with per-key expiry.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._scan_cursors = {}
+        self._cursor_id = 0
+        self._lock = threading.Lock()
+
+    # Keyspace helpers
+    def _alive(self, key):
+        deadline = self._expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._data
+
+    def _get(self, key, kind):
+        if not self._alive(key):
+            return None
+        value = self._data[key]
+        if type(value) is not kind:
+            raise CommandError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _get_or_create(self, key, kind):
+        value = self._get(key, kind)
+        if value is None:
+            value = self._data[key] = kind()
+        return value
+
+    def _drop_if_empty(self, key):
+        if key in self._data and not self._data[key]:
+            del self._data[key]
+            self._expires.pop(key, None)
+
+    def execute(self, command):
+        if not command:
+            raise CommandError("ERR empty command")
+        name, args = str(command[0]).lower(), [str(arg) for arg in command[1:]]
+        handler = getattr(self, f"cmd_{name}", None)
+        if handler is None:
+            raise CommandError(f"ERR unknown command '{name}'")
+        with self._lock:
+            try:
+                return handler(*args)
+            except TypeError:
+                raise CommandError(f"ERR wrong number of arguments for '{name}' command")
+
+    # Generic commands
+    def cmd_ping(self):
+        return "PONG"
+
+    def cmd_flushall(self):
+        self._data.clear()
+        self._expires.clear()
+        return "OK"
+
+    def cmd_exists(self, *keys):
+        return sum(1 for key in keys if self._alive(key))
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._alive(key):
+                del self._data[key]
+                self._expires.pop(key, None)
+                removed += 1
+        return removed
+
+    def cmd_expire(self, key, seconds):
+        if not self._alive(key):
+            return 0
+        self._expires[key] = time.time() + int(seconds)
+        return 1
+
+    def cmd_persist(self, key):
+        if not self._alive(key) or key not in self._expires:
+            return 0
+        del self._expires[key]
+        return 1
+
+    def cmd_ttl(self, key):
+        if not self._alive(key):
+            return -2
+        if key not in self._expires:
+            return -1
+        return max(int(round(self._expires[key] - time.time())), 0)
+
+    def cmd_type(self, key):
+        if not self._alive(key):
+            return "none"
+        return {str: "string", dict: "hash", set: "set", SortedSet: "zset"}[type(self._data[key])]
+
+    def cmd_keys(self, pattern):
+        return [key for key in list(self._data) if self._alive(key) and fnmatch.fnmatchcase(key, pattern)]
+
+    def cmd_scan(self, cursor, *options):
+        match, count, kind = "*", 10, None
+        for i in range(0, len(options) - 1, 2):
+            option, value = options[i].lower(), options[i + 1]
+            if option == "match":
+                match = value
+            elif option == "count":
+                count = int(value)
+            elif option == "type":
+                kind = value.lower()
+        # Cursors resume after the last key returned, so keys added or removed mid-scan never cause skips
+        after = self._scan_cursors.pop(cursor, "") if cursor != "0" else ""
+        keys = sorted(key for key in self._data if key > after)
+        batch = keys[:count]
+        next_cursor = 0
+        if len(keys) > count:
+            self._cursor_id += 1
+            next_cursor = self._cursor_id
+            self._scan_cursors[str(next_cursor)] = batch[-1]
+        found = [
+            key for key in batch
+            if self._alive(key) and fnmatch.fnmatchcase(key, match) and (kind is None or self.cmd_type(key) == kind)
+        ]
+        return [str(next_cursor), found]
+
+    def cmd_memory(self, subcommand, key, *options):
+        if subcommand.lower() != "usage":
+            raise CommandError("ERR only MEMORY USAGE is supported")
+        if not self._alive(key):
+            return None
+        value = self._data[key]
+        if isinstance(value, (set, SortedSet)):
+            size = sum(len(member) + 8 for member in value)
+        elif isinstance(value, dict):
+            size = sum(len(f) + len(v) for f, v in value.items())
+        else:
+            size = len(value)
+        return size + len(key) + 56
+
+    # Strings
+    def cmd_get(self, key):
+        return self._get(key, str)
+
+    def cmd_set(self, key, value, *options):
+        flags = [option.lower() for option in options]
+        if "nx" in flags and self._alive(key) or "xx" in flags and not self._alive(key):
+            return None
+        self._data[key] = value
+        self._expires.pop(key, None)
+        for i, flag in enumerate(flags[:-1]):
+            if flag == "ex":
+                self._expires[key] = time.time() + int(options[i + 1])
+        return "OK"
+
+    # Hashes
+    def cmd_hset(self, key, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise TypeError
+        value = self._get_or_create(key, dict)
+        added = 0
+        for field, item in zip(pairs[::2], pairs[1::2]):
+            added += field not in value
+            value[field] = item
+        return added
+
+    def cmd_hsetnx(self, key, field, item):
+        value = self._get_or_create(key, dict)
+        if field in value:
+            return 0
+        value[field] = item
+        return 1
+
+    def cmd_hget(self, key, field):
+        value = self._get(key, dict)
+        return None if value is None else value.get(field)
+
+    def cmd_hmget(self, key, *fields):
+        value = self._get(key, dict) or {}
+        return [value.get(field) for field in fields]
+
+    def cmd_hgetall(self, key):
+        value = self._get(key, dict) or {}
+        return [item for pair in value.items() for item in pair]
+
+    def cmd_hdel(self, key, *fields):
+        value = self._get(key, dict) or {}
+        removed = sum(1 for field in fields if value.pop(field, None) is not None)
+        self._drop_if_empty(key)
+        return removed
+
+    def cmd_hexists(self, key, field):
+        return int(field in (self._get(key, dict) or {}))
+
+    def cmd_hlen(self, key):
+        return len(self._get(key, dict) or {})
+
+    def cmd_hstrlen(self, key, field):
+        return len((self._get(key, dict) or {}).get(field, ""))
+
+    def cmd_hincrby(self, key, field, amount):
+        value = self._get_or_create(key, dict)
+        try:
+            value[field] = str(int(value.get(field, 0)) + int(amount))
+        except ValueError:
+            raise CommandError("ERR hash value is not an integer")
+        return int(value[field])
+
+    # Sets
+    def cmd_sadd(self, key, *members):
+        value = self._get_or_create(key, set)
+        before = len(value)
+        value.update(members)
+        return len(value) - before
+
+    def cmd_smembers(self, key):
+        return sorted(self._get(key, set) or ())
+
+    # Sorted sets
+    def cmd_zadd(self, key, *args):
+        flags = set()
+        while args and args[0].lower() in ("nx", "xx", "gt", "lt", "ch"):
+            flags.add(args[0].lower())
+            args = args[1:]
+        if not args or len(args) % 2:
+            raise TypeError
+        value = self._get_or_create(key, SortedSet)
+        changed = 0
+        for score, member in zip(args[::2], args[1::2]):
+            score = float(score)
+            current = value.get(member)
+            if current is None and "xx" in flags or current is not None and "nx" in flags:
+                continue
+            if current is not None and ("gt" in flags and score <= current or "lt" in flags and score >= current):
+                continue
+            if current is None or ("ch" in flags and current != score):
+                changed += 1
+            value[member] = score
+        self._drop_if_empty(key)
+        return changed
+
+    def cmd_zincrby(self, key, amount, member):
+        value = self._get_or_create(key, SortedSet)
+        value[member] = value.get(member, 0.0) + float(amount)
+        return _format_score(value[member])
+
+    def cmd_zrem(self, key, *members):
+        value = self._get(key, SortedSet) or SortedSet()
+        removed = sum(1 for member in members if value.pop(member, None) is not None)
+        self._drop_if_empty(key)
+        return removed
+
+    def cmd_zscore(self, key, member):
+        score = (self._get(key, SortedSet) or SortedSet()).get(member)
+        return None if score is None else _format_score(score)
+
+    def cmd_zcard(self, key):
+        return len(self._get(key, SortedSet) or ())
+
+    def cmd_zcount(self, key, low, high):
+        return len(self._by_score(key, low, high))
+
+    def cmd_zscan(self, key, cursor, *options):
+        count = 10
+        for i in range(0, len(options) - 1, 2):
+            if options[i].lower() == "count":
+                count = int(options[i + 1])
+        members = self._ordered(key, reverse=False)
+        start = int(cursor)
+        next_cursor = start + count if start + count < len(members) else 0
+        return [str(next_cursor), self._with_scores(key, members[start:start + count], ["withscores"])]
+
+    def cmd_zrange(self, key, start, stop, *options):
+        return self._range(key, start, stop, options, reverse=False)
+
+    def cmd_zrevrange(self, key, start, stop, *options):
+        return self._range(key, start, stop, options, reverse=True)
+
+    def cmd_zrangebyscore(self, key, low, high, *options):
+        members = self._by_score(key, low, high)
+        if len(options) >= 3 and options[-3].lower() == "limit":
+            offset, count = int(options[-2]), int(options[-1])
+            members = members[offset:offset + count if count >= 0 else None]
+        return self._with_scores(key, members, options)
+
+    def cmd_zremrangebyrank(self, key, start, stop):
+        members = self._range(key, start, stop, (), reverse=False)
+        return self.cmd_zrem(key, *members) if members else 0
+
+    def cmd_zremrangebyscore(self, key, low, high):
+        members = self._by_score(key, low, high)
+        return self.cmd_zrem(key, *members) if members else 0
+
+    def _ordered(self, key, reverse):
+        value = self._get(key, SortedSet) or SortedSet()
+        return sorted(value, key=lambda member: (value[member], member), reverse=reverse)
+
+    def _range(self, key, start, stop, options, reverse):
+        members = self._ordered(key, reverse)
+        start, stop = int(start), int(stop)
+        stop = len(members) + stop if stop < 0 else stop
+        start = max(len(members) + start if start < 0 else start, 0)
+        return self._with_scores(key, members[start:stop + 1] if stop >= 0 else [], options)
+
+    def _by_score(self, key, low, high):
+        value = self._get(key, SortedSet) or SortedSet()
+        low_open, high_open = low.startswith("("), high.startswith("(")
+        low, high = float(low.lstrip("(")), float(high.lstrip("("))
+        return [
+            member for member in self._ordered(key, reverse=False)
+            if (value[member] > low if low_open else value[member] >= low)
+            and (value[member] < high if high_open else value[member] <= high)
+        ]
+
+    def _with_scores(self, key, members, options):
+        if "withscores" not in (option.lower() for option in options):
+            return members
+        value = self._get(key, SortedSet)
+        return [item for member in members for item in (member, _format_score(value[member]))]
+
+
+class SortedSet(dict):
+    """Member -> score mapping; ordering is computed on read, which is plenty for load-test volumes."""
+
+
+def _format_score(score):
+    return str(int(score)) if float(score).is_integer() else repr(float(score))
+
+
+def make_handler(store, token=None, latency_ms=0.0, jitter_ms=0.0):
+    """
+    Build a request handler class bound to `store` that injects `latency_ms` (+ up to `jitter_ms`) per request.
+    """
+
+    class UpstashHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _run(self, command):
+            try:
+                return 200, {"result": store.execute(command)}
+            except (CommandError, ValueError) as e:
+                return 400, {"error": str(e)}
+
+        def _handle(self, body):
+            if latency_ms or jitter_ms:
+                time.sleep((latency_ms + random.uniform(0, jitter_ms)) / 1000)
+            if token is not None and self.headers.get("Authorization") != f"Bearer {token}":
+                return self._reply(401, {"error": "Unauthorized"})
+
+            path = self.path.split("?", 1)[0]
+            parts = [unquote(part) for part in path.strip("/").split("/") if part]
+
+            try:
+                payload = json.loads(body) if (body and not parts) or parts == ["pipeline"] else None
+            except ValueError:
+                return self._reply(400, {"error": "ERR failed to parse command"})
+
+            if parts == ["pipeline"]:
+                if not isinstance(payload, list):
+                    return self._reply(400, {"error": "ERR pipeline body must be a list of commands"})
+                return self._reply(200, [self._run(command)[1] for command in payload])
+            if not parts:
+                if not isinstance(payload, list):
+                    return self._reply(400, {"error": "ERR command body must be a list"})
+                return self._reply(*self._run(payload))
+            if body:
+                parts.append(body.decode())
+            return self._reply(*self._run(parts))
+
+        def do_GET(self):
+            self._handle(b"")
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            self._handle(self.rfile.read(length) if length else b"")
+
+    return UpstashHandler
+
+
+def serve(host="127.0.0.1", port=0, token=None, latency_ms=0.0, jitter_ms=0.0, store=None):
+    """
+    Start the fake server on a background thread and return it; `server.server_address` holds the bound port.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(store or FakeRedis(), token, latency_ms, jitter_ms))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-upstash", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Upstash-compatible Redis REST stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8079)
+    parser.add_argument("--token", default=None, help="Require this bearer token (default: accept any)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latency injected into every request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Extra uniformly distributed latency")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.token, args.latency_ms, args.jitter_ms)
+    print(f"Fake Upstash listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+"""
+This file is the end-to-end load-test harness for the Flask API in `api/index.py`.
+
+It boots the app under gunicorn against the local Upstash stand-in from `loadtest/fake_upstash.py` (with
+configurable injected latency), replays a weighted mix of encode/decode/feed/like/comment traffic at a target
+request rate, and reports throughput, error rate, latency percentiles and the memory (RSS and PSS) of the gunicorn
+process tree.
+
+Requests are issued open-loop: each one is scheduled at a fixed offset from the start of the run and its latency
+is measured from that scheduled time, so a saturated server shows up as growing latency instead of silently
+lowering the offered load.
+
+Example (run from the repository root):
+
+    python -m loadtest.run --workers 2 --threads 8 --rps 50 --duration 30 \\
+        --mix encode=30,decode=30,feed=25,like=10,comment=5 --sizes 1k=0.6,64k=0.3,1m=0.1 --upstash-latency-ms 5
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import base64
+import json
+import math
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from loadtest.fake_upstash import serve
+
+OPERATIONS = ("encode", "decode", "feed", "trending", "like", "comment")
+PASSWORD = "loadtest-password"
+SIZE_UNITS = {"k": 1024, "m": 1024 * 1024}
+
+
+def parse_weights(spec, allowed=None):
+    """
+    Parse `name=weight,name=weight` into a dict, validating names against `allowed` when given.
+    """
+    weights = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, weight = item.partition("=")
+        if allowed is not None and name not in allowed:
+            raise argparse.ArgumentTypeError(f"Unknown operation '{name}', expected one of {', '.join(allowed)}")
+        weights[name] = float(weight or 1)
+    if not weights or sum(weights.values()) <= 0:
+        raise argparse.ArgumentTypeError(f"Invalid weight specification: {spec}")
+    return weights
+
+
+def parse_size(size):
+    """
+    Parse a payload size such as `512`, `64k` or `1m` into bytes.
+    """
+    size = size.strip().lower()
+    if size[-1:] in SIZE_UNITS:
+        return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+    return int(size)
+
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def read_kb_field(path, name):
+    """
+    Return the `name:` field of a /proc status-style file in bytes, or None when it is missing or unreadable.
+    """
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(name):
+                    return int(line.split()[1]) * 1024
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+def process_tree_memory(root_pid):
+    """
+    Sum the memory (in bytes) of `root_pid` and all its descendants, read from /proc, and return (rss, pss).
+
+    RSS counts the copy-on-write pages workers share with the preloaded master once per process, so it overstates
+    the real footprint; PSS splits every shared page between the processes mapping it. Where smaps_rollup is
+    unavailable a process's PSS falls back to its RSS.
+    """
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    rss_total, pss_total, pending = 0, 0, [root_pid]
+    while pending:
+        pid = pending.pop()
+        pending.extend(children.get(pid, []))
+        rss = read_kb_field(f"/proc/{pid}/status", "VmRSS:")
+        if rss is None:
+            continue
+        pss = read_kb_field(f"/proc/{pid}/smaps_rollup", "Pss:")
+        rss_total += rss
+        pss_total += rss if pss is None else pss
+    return rss_total, pss_total
+
+
+class Recorder:
+    """
+    Thread-safe collection of per-request samples: (operation, scheduled offset, latency seconds, success), plus
+    memory samples: (offset, rss bytes, pss bytes).
+    """
+
+    def __init__(self):
+        self.samples = []
+        self.memory = []
+        self._lock = threading.Lock()
+
+    def add(self, operation, offset, latency, ok):
+        with self._lock:
+            self.samples.append((operation, offset, latency, ok))
+
+
+class Workload:
+    """
+    Issues individual API calls against the app, keeping one HTTP session per client thread.
+    """
+
+    def __init__(self, base_url, sizes, rng):
+        self.base_url = base_url
+        self.sizes = sizes
+        self.rng = rng
+        self.file_ids = []
+        self.post_ids = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Payloads are generated once per size so the client does not compete with the server for CPU
+        self.payloads = {size: base64.b64encode(os.urandom(size)).decode() for size in sizes}
+
+    @property
+    def session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _pick(self, pool):
+        with self._lock:
+            return self.rng.choice(pool) if pool else None
+
+    def _choose_size(self):
+        with self._lock:
+            return self.rng.choices(list(self.sizes), weights=list(self.sizes.values()))[0]
+
+    def encode(self):
+        size = self._choose_size()
+        response = self.session.post(f"{self.base_url}/api/encode", json={
+            "file_data": self.payloads[size],
+            "password": PASSWORD,
+            "reads": 10 ** 9,
+            "ttl": 3600,
+            "file_name": f"load-{size}.bin",
+        })
+        if response.status_code == 200:
+            with self._lock:
+                self.file_ids.append(response.json()["file_id"])
+        return response
+
+    def decode(self):
+        file_id = self._pick(self.file_ids)
+        if file_id is None:
+            return self.encode()
+        return self.session.post(f"{self.base_url}/api/decode", json={"file_id": file_id, "password": PASSWORD})
+
+    def create_post(self):
+        response = self.session.post(f"{self.base_url}/api/posts", json={
+            "title": "Load test post",
+            "content": "x" * 280,
+            "author": "loadtest",
+            "ttl": 3600,
+        })
+        if response.status_code == 201:
+            with self._lock:
+                self.post_ids.append(response.json()["post_id"])
+        return response
+
+    def feed(self):
+        return self.session.get(f"{self.base_url}/api/posts")
+
+    def trending(self):
+        return self.session.get(f"{self.base_url}/api/posts", params={"sort": "trending"})
+
+    def like(self):
+        post_id = self._pick(self.post_ids)
+        if post_id is None:
+            return self.create_post()
+        return self.session.post(f"{self.base_url}/api/posts/{post_id}/like")
+
+    def comment(self):
+        post_id = self._pick(self.post_ids)
+        if post_id is None:
+            return self.create_post()
+        return self.session.post(f"{self.base_url}/{post_id}/comment", json={
+            "content": "Load test comment",
+            "author": "loadtest",
+        })
+
+
+def start_gunicorn(args, port, upstash_url, token):
+    env = dict(os.environ, UPSTASH_REDIS_URL=upstash_url, UPSTASH_REDIS_PASSWORD=token)
+    command = [
+        sys.executable, "-m", "gunicorn", args.app,
+        "--bind", f"127.0.0.1:{port}",
+        "--workers", str(args.workers),
+        "--threads", str(args.threads),
+        "--worker-class", args.worker_class,
+        "--log-level", "warning",
+        *args.gunicorn_arg,
+    ]
+    return subprocess.Popen(command, env=env)
+
+
+def wait_until_ready(base_url, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("gunicorn did not become ready in time")
+
+
+def sample_memory(process, recorder, start, interval, stop):
+    while not stop.wait(interval):
+        recorder.memory.append((time.perf_counter() - start, *process_tree_memory(process.pid)))
+
+
+def run_load(workload, mix, rps, duration, concurrency, recorder, rng):
+    """
+    Fire requests open-loop at `rps` for `duration` seconds using at most `concurrency` client threads.
+    """
+    operations, weights = list(mix), list(mix.values())
+
+    def call(operation, scheduled, offset):
+        try:
+            ok = getattr(workload, operation)().status_code < 400
+        except requests.RequestException:
+            ok = False
+        recorder.add(operation, offset, time.perf_counter() - scheduled, ok)
+
+    total = int(rps * duration)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        for i in range(total):
+            offset = i / rps
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(call, rng.choices(operations, weights=weights)[0], start + offset, offset)
+    return time.perf_counter() - start
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(latency for _, _, latency, _ in samples)
+    errors = sum(1 for *_, ok in samples if not ok)
+    return {
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        **{f"p{pct}_ms": round(percentile(latencies, pct) * 1000, 2) for pct in (50, 90, 99)},
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+def build_report(recorder, elapsed, interval, config):
+    samples = recorder.samples
+    by_operation = {}
+    for sample in samples:
+        by_operation.setdefault(sample[0], []).append(sample)
+
+    # Bucket requests by when they completed so the per-interval rps shows delivered throughput, which falls
+    # below the target rate once the server saturates
+    timeline = []
+    buckets = {}
+    for sample in samples:
+        buckets.setdefault(int((sample[1] + sample[2]) // interval), []).append(sample)
+    memory_points = dict((int(t // interval), (rss, pss)) for t, rss, pss in recorder.memory)
+    for bucket in sorted(set(buckets) | set(memory_points)):
+        row = {"t": round(bucket * interval, 1), **summarize(buckets.get(bucket, []), interval)}
+        rss, pss = memory_points.get(bucket, (0, 0))
+        row["rss_mb"] = round(rss / (1024 * 1024), 1)
+        row["pss_mb"] = round(pss / (1024 * 1024), 1)
+        timeline.append(row)
+
+    return {
+        "config": config,
+        "total": summarize(samples, elapsed),
+        "operations": {name: summarize(items, elapsed) for name, items in sorted(by_operation.items())},
+        "peak_rss_mb": round(max((rss for _, rss, _ in recorder.memory), default=0) / (1024 * 1024), 1),
+        "peak_pss_mb": round(max((pss for _, _, pss in recorder.memory), default=0) / (1024 * 1024), 1),
+        "timeline": timeline,
+    }
+
+
+def print_report(report):
+    columns = ("requests", "throughput_rps", "error_rate", "p50_ms", "p90_ms", "p99_ms", "max_ms")
+    print(f"\n{'operation':<10}" + "".join(f"{column:>16}" for column in columns))
+    for name, stats in [*report["operations"].items(), ("TOTAL", report["total"])]:
+        print(f"{name:<10}" + "".join(f"{stats[column]:>16}" for column in columns))
+
+    print(f"\n{'t (s)':>8}{'rps':>10}{'errors':>10}{'p99 ms':>12}{'rss MB':>10}{'pss MB':>10}")
+    for row in report["timeline"]:
+        print(
+            f"{row['t']:>8}{row['throughput_rps']:>10}{row['error_rate']:>10}{row['p99_ms']:>12}"
+            f"{row['rss_mb']:>10}{row['pss_mb']:>10}"
+        )
+    print(f"\nPeak RSS: {report['peak_rss_mb']} MB, peak PSS: {report['peak_pss_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test api/index.py under gunicorn against a local fake Upstash")
+    parser.add_argument("--app", default="api.index:app", help="WSGI application passed to gunicorn")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--worker-class", default="gthread", help="gunicorn worker class (sync, gthread, gevent, ...)")
+    parser.add_argument("--gunicorn-arg", action="append", default=[], help="Extra argument passed to gunicorn")
+    parser.add_argument("--port", type=int, default=5329)
+    parser.add_argument("--upstash-url", default=None, help="Use an existing Upstash endpoint instead of the fake")
+    parser.add_argument("--upstash-token", default="loadtest-token")
+    parser.add_argument("--upstash-latency-ms", type=float, default=2.0)
+    parser.add_argument("--upstash-jitter-ms", type=float, default=1.0)
+    parser.add_argument("--rps", type=float, default=20.0, help="Target request rate")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of measured traffic")
+    parser.add_argument("--concurrency", type=int, default=128, help="Maximum in-flight client requests")
+    parser.add_argument("--mix", type=lambda spec: parse_weights(spec, OPERATIONS),
+                        default="encode=30,decode=30,feed=20,trending=5,like=10,comment=5")
+    parser.add_argument("--sizes", type=parse_weights, default="1k=0.6,64k=0.3,1m=0.1",
+                        help="Encode payload size distribution, e.g. 1k=0.6,64k=0.3,1m=0.1")
+    parser.add_argument("--seed-posts", type=int, default=20)
+    parser.add_argument("--seed-files", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=1.0, help="Timeline bucket and memory sampling interval")
+    parser.add_argument("--random-seed", type=int, default=None)
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write the report as JSON here")
+    args = parser.parse_args()
+
+    rng = random.Random(args.random_seed)
+    sizes = {parse_size(size): weight for size, weight in args.sizes.items()}
+
+    fake = None
+    upstash_url = args.upstash_url
+    if upstash_url is None:
+        fake = serve(token=args.upstash_token, latency_ms=args.upstash_latency_ms, jitter_ms=args.upstash_jitter_ms)
+        upstash_url = f"http://127.0.0.1:{fake.server_address[1]}"
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    process = start_gunicorn(args, args.port, upstash_url, args.upstash_token)
+    recorder, stop = Recorder(), threading.Event()
+    try:
+        wait_until_ready(base_url, process)
+        print(f"gunicorn ready at {base_url} ({args.workers} workers x {args.threads} threads, {args.worker_class})")
+
+        workload = Workload(base_url, sizes, rng)
+        for _ in range(args.seed_posts):
+            workload.create_post()
+        for _ in range(args.seed_files):
+            workload.encode()
+
+        start = time.perf_counter()
+        recorder.memory.append((0.0, *process_tree_memory(process.pid)))
+        threading.Thread(target=sample_memory, args=(process, recorder, start, args.interval, stop), daemon=True).start()
+        elapsed = run_load(workload, args.mix, args.rps, args.duration, args.concurrency, recorder, rng)
+    finally:
+        stop.set()
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        if fake is not None:
+            fake.shutdown()
+
+    config = {key: value for key, value in vars(args).items() if key != "json_path"}
+    config["sizes"] = sizes
+    report = build_report(recorder, elapsed, args.interval, config)
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
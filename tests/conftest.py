@@ -0,0 +1,41 @@
+import pytest
+
+from api.index import create_app
+from loadtest.fake_upstash import FakeRedis, serve
+
+
+@pytest.fixture
+def store():
+    return FakeRedis()
+
+
+@pytest.fixture
+def upstash_url(store):
+    server = serve(store=store)
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest.fixture
+def client(upstash_url):
+    app = create_app({
+        "UPSTASH_REDIS_URL": upstash_url,
+        "UPSTASH_REDIS_PASSWORD": "test",
+        "COMMENT_MAX_LIVE": 3,
+        "COMMENT_SWEEP_INTERVAL": 0,
+    })
+    return app.test_client()
+
+
+@pytest.fixture
+def run_pipeline(store):
+    return lambda commands: [store.execute(command) for command in commands]
+
+
+@pytest.fixture
+def create_post(client):
+    def create(title="post"):
+        response = client.post("/api/posts", json={"title": title, "content": "content"})
+        assert response.status_code == 201
+        return response.get_json()["post_id"]
+    return create
@@ -0,0 +1,159 @@
+from datetime import datetime, timedelta
+import json
+import time
+
+import pytest
+
+from api.comments import (
+    apply_cap, comment_expires_at, live_comments, load_comments, normalize_ttl, split_expired,
+    sweep_expired_comments,
+)
+from api.constants import COMMENT_DEFAULT_TTL
+from api.trending import parse_created_at
+
+
+def comment(content, age=0, ttl=100):
+    timestamp = (datetime.utcnow() - timedelta(seconds=age)).isoformat()
+    return {"content": content, "author": "a", "author_id": content, "timestamp": timestamp, "ttl": ttl}
+
+
+def contents(comments):
+    return [c["content"] for c in comments]
+
+
+def shift_clock(monkeypatch, seconds):
+    now = time.time
+    monkeypatch.setattr(time, "time", lambda: now() + seconds)
+
+
+def test_load_comments_reads_plain_and_wrapped_lists():
+    comments = [comment("one"), comment("two")]
+    assert load_comments(json.dumps(comments)) == comments
+    assert load_comments(json.dumps({"comments": json.dumps(comments)})) == comments
+
+
+@pytest.mark.parametrize("raw", [None, "", "not json", "42", json.dumps({"comments": None}), json.dumps(["x"])])
+def test_load_comments_tolerates_bad_values(raw):
+    assert load_comments(raw) == []
+
+
+def test_normalize_ttl():
+    assert normalize_ttl(None) == COMMENT_DEFAULT_TTL
+    assert normalize_ttl(0) == COMMENT_DEFAULT_TTL
+    assert normalize_ttl(-5) == COMMENT_DEFAULT_TTL
+    assert normalize_ttl("60") == 60
+    for value in ("abc", 1.5, True, [60]):
+        with pytest.raises(ValueError):
+            normalize_ttl(value)
+
+
+def test_non_positive_ttl_still_expires():
+    record = comment("forever", ttl=0)
+    assert comment_expires_at(record) == parse_created_at(record["timestamp"]) + COMMENT_DEFAULT_TTL
+
+
+def test_split_expired():
+    live, expired = split_expired([comment("old", age=200), comment("new", age=10)], time.time())
+    assert contents(live) == ["new"]
+    assert contents(expired) == ["old"]
+
+
+def test_apply_cap_keeps_newest():
+    comments = [comment(str(i), age=10 - i) for i in range(5)]
+    kept, dropped = apply_cap(comments, 3)
+    assert contents(kept) == ["2", "3", "4"]
+    assert contents(dropped) == ["0", "1"]
+    assert apply_cap(comments, 0) == (comments, [])
+
+
+def test_live_comments_merges_legacy_and_stored():
+    legacy = json.dumps({"comments": json.dumps([comment("legacy", age=20), comment("gone", age=500)])})
+    stored = comment("stored", age=5)
+    assert contents(live_comments(["stored", json.dumps(stored)], legacy, time.time())) == ["legacy", "stored"]
+
+
+def test_reads_hide_expired_comments_without_writing(client, store, create_post, monkeypatch):
+    post_id = create_post()
+    client.post(f"/{post_id}/comment", json={"content": "short", "ttl": 10})
+    client.post(f"/{post_id}/comment", json={"content": "long", "ttl": 1000})
+    stored = store.execute(["hgetall", f"comments:{post_id}"])
+
+    shift_clock(monkeypatch, 60)
+    assert contents(client.get("/api/posts").get_json()[0]["comments"]) == ["long"]
+    assert contents(client.get("/api/posts?sort=trending").get_json()[0]["comments"]) == ["long"]
+    assert store.execute(["hgetall", f"comments:{post_id}"]) == stored
+
+
+def test_add_comment_caps_live_comments(client, store, create_post):
+    post_id = create_post()
+    for i in range(5):
+        response = client.post(f"/{post_id}/comment", json={"content": f"c{i}"})
+        assert response.status_code == 200
+    assert contents(response.get_json()["comments"]) == ["c2", "c3", "c4"]
+    assert store.execute(["hlen", f"comments:{post_id}"]) == 3
+    assert store.execute(["zcard", f"comment_expiry:{post_id}"]) == 3
+
+
+def test_add_comment_removes_expired_comments(client, store, create_post, monkeypatch):
+    post_id = create_post()
+    client.post(f"/{post_id}/comment", json={"content": "short", "ttl": 10})
+    shift_clock(monkeypatch, 60)
+    response = client.post(f"/{post_id}/comment", json={"content": "next"})
+    assert contents(response.get_json()["comments"]) == ["next"]
+    assert store.execute(["hlen", f"comments:{post_id}"]) == 1
+
+
+@pytest.mark.parametrize("ttl", ["abc", 1.5, [1]])
+def test_add_comment_rejects_bad_ttl(client, create_post, ttl):
+    post_id = create_post()
+    assert client.post(f"/{post_id}/comment", json={"content": "x", "ttl": ttl}).status_code == 400
+
+
+def test_add_comment_to_missing_post(client, store):
+    assert client.post("/missing/comment", json={"content": "x"}).status_code == 404
+    assert store.execute(["keys", "*"]) == []
+
+
+def test_comment_keys_expire_with_post(client, store, create_post):
+    post_id = create_post()
+    client.post(f"/{post_id}/comment", json={"content": "x"})
+    post_ttl = store.execute(["ttl", f"post:{post_id}"])
+    assert 0 < store.execute(["ttl", f"comments:{post_id}"]) <= post_ttl
+    assert 0 < store.execute(["ttl", f"comment_expiry:{post_id}"]) <= post_ttl
+
+
+def test_delete_comment_uses_displayed_index(client, store, create_post):
+    post_id = create_post()
+    for content in ("first", "second", "third"):
+        client.post(f"/{post_id}/comment", json={"content": content})
+    assert client.delete(f"/{post_id}/comment/1").status_code == 200
+    assert contents(client.get("/api/posts").get_json()[0]["comments"]) == ["first", "third"]
+    assert store.execute(["zcard", f"comment_expiry:{post_id}"]) == 2
+    assert client.delete(f"/{post_id}/comment/5").status_code == 404
+
+
+def test_legacy_comments_migrate_on_write(client, store, create_post):
+    post_id = create_post()
+    legacy = [comment("legacy", age=30)]
+    store.execute(["hset", f"post:{post_id}", "comments", json.dumps({"comments": json.dumps(legacy)})])
+    assert contents(client.get("/api/posts").get_json()[0]["comments"]) == ["legacy"]
+
+    response = client.post(f"/{post_id}/comment", json={"content": "new"})
+    assert contents(response.get_json()["comments"]) == ["legacy", "new"]
+    assert store.execute(["hexists", f"post:{post_id}", "comments"]) == 0
+    assert store.execute(["hlen", f"comments:{post_id}"]) == 2
+
+
+def test_sweep_removes_expired_comments(client, store, create_post, run_pipeline, monkeypatch):
+    post_id = create_post()
+    client.post(f"/{post_id}/comment", json={"content": "short", "ttl": 10})
+    client.post(f"/{post_id}/comment", json={"content": "long", "ttl": 1000})
+    gone_id = create_post()
+    client.post(f"/{gone_id}/comment", json={"content": "orphan", "ttl": 10})
+    store.execute(["del", f"post:{gone_id}"])
+
+    shift_clock(monkeypatch, 60)
+    assert sweep_expired_comments(run_pipeline, batch_size=1) == 1
+    assert contents(client.get("/api/posts").get_json()[0]["comments"]) == ["long"]
+    assert store.execute(["hlen", f"comments:{post_id}"]) == 1
+    assert store.execute(["exists", f"comments:{gone_id}", f"comment_expiry:{gone_id}"]) == 0
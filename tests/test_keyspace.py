@@ -0,0 +1,128 @@
+import argparse
+import base64
+import json
+
+import pytest
+
+from api import keyspace
+from api.comments import new_comment
+from api.constants import TRENDING_KEY
+from api.encryption.aes256 import AES256Encryption
+
+
+def entries(*results):
+    return [{"result": value} for value in results]
+
+
+@pytest.mark.parametrize("key, replies, expected", [
+    ("cipher_share:a", entries("hash", 100, 512, 400, 1, 1), []),
+    ("cipher_share:a", entries("hash", -1, 512, 400, 1, 0), ["ttl", "legacy"]),
+    ("cipher_share:a", entries("hash", 100, 512, 0, 0, 0), ["orphan"]),
+    ("post:a", entries("hash", 100, 256, 0, 1, 0, "1.5"), []),
+    ("post:a", entries("hash", 100, 256, 80, 1, 1, "1.5"), ["legacy"]),
+    ("post:a", entries("hash", 100, 256, 0, 1, 0, None), ["legacy"]),
+    ("post:a", entries("hash", -1, 256, 0, 0, 0, None), ["ttl", "orphan"]),
+    ("post:a", entries("string", 100, 256, 0, 0, 0, None), ["wrong_type"]),
+    ("comments:a", entries("hash", 100, 256, 2, 0), ["orphan"]),
+    ("comment_expiry:a", entries("zset", -1, 256, 2, 1), ["ttl"]),
+    ("post:a", entries("none", -2, None, 0, 0, 0, None), []),
+])
+def test_classify(key, replies, expected):
+    assert keyspace.classify(key, replies)[3] == expected
+
+
+def test_classify_falls_back_to_field_length_without_memory_usage():
+    replies = entries("hash", 100) + [{"error": "ERR unknown command"}] + entries(400, 1, 1)
+    assert keyspace.classify("cipher_share:a", replies)[2] == 400
+
+
+def fix(monkeypatch, upstash_url, orphan_grace=0):
+    monkeypatch.setenv("UPSTASH_REDIS_URL", upstash_url)
+    monkeypatch.setenv("UPSTASH_REDIS_PASSWORD", "test")
+    return keyspace.main([
+        "fix", "--fix", "ttl,orphans,legacy", "--count", "2", "--fix-rate", "0", "--orphan-grace", str(orphan_grace)
+    ])
+
+
+def test_legacy_share_can_be_decoded_after_fix(client, store, upstash_url, monkeypatch):
+    encrypted, metadata = AES256Encryption().encrypt(b"legacy data", "pw")
+    urlsafe = lambda value: base64.urlsafe_b64encode(value).decode().rstrip("=")
+    store.execute([
+        "hset", "cipher_share:legacy", "encrypted_data", urlsafe(encrypted), "iv", urlsafe(metadata["iv"]),
+        "tag", urlsafe(metadata["tag"]), "salt", urlsafe(metadata["salt"]), "reads", 3,
+    ])
+
+    assert fix(monkeypatch, upstash_url) == 0
+    assert store.execute(["ttl", "cipher_share:legacy"]) > 0
+    response = client.post("/api/decode", json={"file_id": "legacy", "password": "pw"})
+    assert response.status_code == 200
+    assert base64.b64decode(response.get_json()["decrypted_data"]) == b"legacy data"
+
+
+def test_legacy_post_fix_keeps_concurrent_comments(client, store, create_post, upstash_url, monkeypatch):
+    post_id = create_post()
+    legacy = new_comment("legacy", "a", "legacy-id", 1000)
+    store.execute(["hset", f"post:{post_id}", "comments", json.dumps([legacy]), "comment_count", 1])
+    # A comment the app stored under the same post after the legacy list was written
+    client.post(f"/{post_id}/comment", json={"content": "new"})
+    store.execute(["hset", f"post:{post_id}", "comments", json.dumps([legacy])])
+    score = store.execute(["zscore", TRENDING_KEY, f"post:{post_id}"])
+
+    assert fix(monkeypatch, upstash_url) == 0
+    assert store.execute(["hexists", f"post:{post_id}", "comments"]) == 0
+    assert store.execute(["hexists", f"post:{post_id}", "comment_count"]) == 0
+    assert [c["content"] for c in client.get("/api/posts").get_json()[0]["comments"]] == ["legacy", "new"]
+    assert store.execute(["zscore", TRENDING_KEY, f"post:{post_id}"]) == score
+
+
+def test_legacy_fix_reads_count_against_fix_rate(store, monkeypatch):
+    waits = []
+
+    class Limiter:
+        def wait(self, operations=1):
+            waits.append(operations)
+
+    upstash = keyspace.Upstash("http://unused", "test")
+    monkeypatch.setattr(upstash, "pipeline", lambda commands: [{"result": store.execute(c)} for c in commands])
+    store.execute(["hset", "post:a", "created_at", "2030-01-01T00:00:00", "comments", "[]"])
+    args = argparse.Namespace(default_share_ttl=60)
+    keyspace.legacy_fix(upstash, "post:a", 100, args, Limiter())
+    assert waits == [2]
+
+
+def test_fix_backfills_posts_missing_from_trending(client, store, create_post, upstash_url, monkeypatch):
+    post_id = create_post()
+    store.execute(["zrem", TRENDING_KEY, f"post:{post_id}"])
+    assert client.get("/api/posts?sort=trending").get_json() == []
+
+    assert fix(monkeypatch, upstash_url) == 0
+    assert [post["_id"] for post in client.get("/api/posts?sort=trending").get_json()] == [post_id]
+
+
+def test_orphans_completed_during_the_grace_period_are_kept(store, upstash_url, monkeypatch):
+    # A share caught between its first and last HSET, and a post hash left behind by a failed write
+    store.execute(["hset", "cipher_share:writing", "iv", "x", "salt", "y"])
+    store.execute(["hset", "post:broken", "likes", 1])
+    store.execute(["zadd", "comment_expiry:gone", 1, "x"])
+    sleeps = []
+
+    def finish_write(seconds):
+        sleeps.append(seconds)
+        store.execute(["hset", "cipher_share:writing", "encrypted_data", "z", "file_type", "text/plain"])
+
+    monkeypatch.setattr(keyspace.time, "sleep", finish_write)
+    assert fix(monkeypatch, upstash_url, orphan_grace=30) == 0
+    assert len(sleeps) == 1 and 0 < sleeps[0] <= 30
+    assert store.execute(["exists", "cipher_share:writing"]) == 1
+    assert store.execute(["exists", "post:broken", "comment_expiry:gone"]) == 0
+
+
+@pytest.mark.parametrize("walk", [
+    lambda upstash: list(keyspace.scan_keyspace(upstash, "*", 10, keyspace.RateLimiter(0))),
+    lambda upstash: keyspace.trending_orphans(upstash, 10, keyspace.RateLimiter(0)),
+])
+def test_failed_scan_raises_instead_of_ending_the_walk(walk, monkeypatch):
+    upstash = keyspace.Upstash("http://unused", "test")
+    monkeypatch.setattr(upstash, "pipeline", lambda commands: [{"error": "ERR max requests limit exceeded"}])
+    with pytest.raises(RuntimeError, match="max requests limit exceeded"):
+        walk(upstash)
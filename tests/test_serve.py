@@ -0,0 +1,83 @@
+import pytest
+
+from api import config
+from api.comments import acquire_sweep_lock
+from api.constants import COMMENT_SWEEP_LOCK_KEY
+from api.serve import WORKER_CLASSES, gunicorn_options
+
+
+@pytest.fixture
+def environ(monkeypatch):
+    """
+    Load the config from nothing but the variables a test sets, ignoring `.env` and the caller's environment.
+    """
+    monkeypatch.setattr(config, "load_dotenv", lambda: None)
+    for name in ("PORT", "SERVE_BIND", "SERVE_WORKER_MODE", "SERVE_WORKERS", "SERVE_THREADS", "SERVE_PRELOAD",
+                 "SERVE_TIMEOUT", "SERVE_MAX_REQUESTS", "UPSTASH_POOL_SIZE", "COMMENT_SWEEP_INTERVAL"):
+        monkeypatch.delenv(name, raising=False)
+    return monkeypatch
+
+
+def test_load_config_defaults(environ):
+    environ.setattr(config.os, "cpu_count", lambda: 3)
+    loaded = config.load_config()
+    assert loaded["SERVE_BIND"] == "0.0.0.0:5000"
+    assert loaded["SERVE_WORKER_MODE"] == "thread"
+    assert loaded["SERVE_WORKERS"] == 3
+    assert loaded["SERVE_THREADS"] == 8
+    assert loaded["UPSTASH_POOL_SIZE"] == 10
+    assert loaded["SERVE_PRELOAD"] is True
+    assert loaded["COMMENT_SWEEP_INTERVAL"] == 0
+
+
+def test_load_config_reads_serve_settings(environ):
+    environ.setenv("PORT", "8080")
+    environ.setenv("SERVE_WORKER_MODE", "gevent")
+    environ.setenv("SERVE_WORKERS", "4")
+    environ.setenv("SERVE_THREADS", "32")
+    environ.setenv("SERVE_TIMEOUT", "60")
+    environ.setenv("SERVE_MAX_REQUESTS", "1000")
+    environ.setenv("SERVE_PRELOAD", "false")
+    environ.setenv("COMMENT_SWEEP_INTERVAL", "2.5")
+    loaded = config.load_config()
+    assert loaded["SERVE_BIND"] == "0.0.0.0:8080"
+    assert (loaded["SERVE_WORKER_MODE"], loaded["SERVE_WORKERS"], loaded["SERVE_THREADS"]) == ("gevent", 4, 32)
+    assert (loaded["SERVE_TIMEOUT"], loaded["SERVE_MAX_REQUESTS"]) == (60, 1000)
+    # The Upstash pool grows with the thread count so threads never wait for a connection
+    assert loaded["UPSTASH_POOL_SIZE"] == 32
+    assert loaded["SERVE_PRELOAD"] is False
+    assert loaded["COMMENT_SWEEP_INTERVAL"] == 2.5
+
+
+def test_load_config_rejects_non_numeric_values(environ):
+    environ.setenv("SERVE_WORKERS", "many")
+    with pytest.raises(ValueError):
+        config.load_config()
+
+
+@pytest.mark.parametrize("mode, worker_class, threads", [
+    ("thread", "gthread", 16),
+    ("gevent", "gevent", 1),
+    ("process", "sync", 1),
+])
+def test_gunicorn_options_map_worker_modes(environ, mode, worker_class, threads):
+    environ.setenv("SERVE_WORKER_MODE", mode)
+    environ.setenv("SERVE_THREADS", "16")
+    options = gunicorn_options(config.load_config())
+    assert options["worker_class"] == worker_class
+    assert options["threads"] == threads
+    assert options["preload_app"] is True
+    assert callable(options["when_ready"]) and callable(options["post_worker_init"])
+
+
+def test_gunicorn_options_reject_unknown_mode(environ):
+    environ.setenv("SERVE_WORKER_MODE", "async")
+    with pytest.raises(ValueError, match="Unsupported worker mode 'async'"):
+        gunicorn_options(config.load_config())
+    assert set(WORKER_CLASSES) == {"thread", "gevent", "process"}
+
+
+def test_only_one_worker_takes_the_sweep_lock(store, run_pipeline):
+    assert acquire_sweep_lock(run_pipeline, 60)
+    assert not acquire_sweep_lock(run_pipeline, 60)
+    assert 0 < store.execute(["ttl", COMMENT_SWEEP_LOCK_KEY]) <= 60
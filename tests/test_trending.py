@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+import json
+import time
+
+from api.comments import new_comment, write_trending_scores
+from api.constants import TRENDING_KEY
+from api.trending import parse_created_at, trending_score
+
+
+def test_parse_created_at():
+    assert parse_created_at("1970-01-02T00:00:00") == 86400
+    assert parse_created_at("1970-01-02T00:00:00+01:00") == 82800
+    assert parse_created_at("not a date") == 0.0
+
+
+def test_trending_score_ordering():
+    now = datetime.utcnow()
+    created_at = now.isoformat()
+    assert trending_score(5, 0, created_at) > trending_score(4, 0, created_at)
+    # A comment weighs as much as two likes
+    assert trending_score(0, 1, created_at) == trending_score(2, 0, created_at)
+    # At equal engagement the newer post wins, and enough engagement outweighs age
+    older = (now - timedelta(days=1)).isoformat()
+    assert trending_score(3, 0, created_at) > trending_score(3, 0, older)
+    assert trending_score(100, 0, older) > trending_score(1, 0, created_at)
+    # No engagement scores like a single like instead of failing on log(0)
+    assert trending_score(0, 0, created_at) == trending_score(1, 0, created_at)
+
+
+def titles(client, limit=50):
+    return [post["title"] for post in client.get(f"/api/posts?sort=trending&limit={limit}").get_json()]
+
+
+def test_trending_order_follows_likes_comments_and_deletes(client, create_post):
+    first, second, third = create_post("first"), create_post("second"), create_post("third")
+    assert titles(client) == ["third", "second", "first"]
+
+    for _ in range(3):
+        client.post(f"/api/posts/{first}/like")
+    assert titles(client) == ["first", "third", "second"]
+
+    for content in ("a", "b", "c"):
+        client.post(f"/{second}/comment", json={"content": content})
+    assert titles(client) == ["second", "first", "third"]
+
+    client.delete(f"/api/posts/{second}")
+    assert titles(client) == ["first", "third"]
+
+
+def test_score_drops_when_comments_go(client, store, create_post):
+    post_id = create_post()
+    client.post(f"/{post_id}/comment", json={"content": "x"})
+    with_comment = float(store.execute(["zscore", TRENDING_KEY, f"post:{post_id}"]))
+    client.delete(f"/{post_id}/comment/0")
+    assert float(store.execute(["zscore", TRENDING_KEY, f"post:{post_id}"])) < with_comment
+
+
+def test_like_does_not_readd_deleted_post(client, store, create_post):
+    post_id = create_post()
+    client.delete(f"/api/posts/{post_id}")
+    assert client.post(f"/api/posts/{post_id}/like").status_code == 404
+    assert store.execute(["zscore", TRENDING_KEY, f"post:{post_id}"]) is None
+    assert store.execute(["keys", "*"]) == []
+
+
+def test_likes_and_comments_add_posts_missing_from_the_set(client, store):
+    # A post written before the trending set existed, with comments in the legacy list
+    created_at = (datetime.utcnow() - timedelta(hours=1)).isoformat()
+    legacy = json.dumps([new_comment("legacy", "a", "legacy-id", 1000)])
+    store.execute(["hset", "post:old", "title", "old", "likes", 2, "created_at", created_at, "comments", legacy])
+
+    assert client.post("/api/posts/old/like").status_code == 200
+    assert titles(client) == ["old"]
+    # The legacy comment counts before and after it is migrated by the next comment
+    assert float(store.execute(["zscore", TRENDING_KEY, "post:old"])) == trending_score(3, 1, created_at)
+    client.post("/old/comment", json={"content": "new"})
+    assert float(store.execute(["zscore", TRENDING_KEY, "post:old"])) == trending_score(3, 2, created_at)
+
+
+def test_score_is_rewritten_when_inputs_change_during_the_write(create_post, store, run_pipeline):
+    post_id = create_post()
+    key = f"post:{post_id}"
+    created_at = store.execute(["hget", key, "created_at"])
+
+    raced = []
+
+    def racing_pipeline(commands):
+        results = []
+        for command in commands:
+            results.append(store.execute(command))
+            if command[0] == "zadd" and not raced:
+                # Another request's likes land between this score write and its check
+                raced.append(store.execute(["hincrby", key, "likes", 5]))
+        return results
+
+    write_trending_scores(racing_pipeline, [key], time.time())
+    assert float(store.execute(["zscore", TRENDING_KEY, key])) == trending_score(5, 0, created_at)
+
+
+def test_expired_members_do_not_shorten_results(client, store, create_post):
+    kept = [create_post(f"kept{i}") for i in range(2)]
+    expired = [create_post(f"expired{i}") for i in range(4)]
+    for post_id in kept:
+        client.post(f"/api/posts/{post_id}/like")
+    store.execute(["del", *[f"post:{post_id}" for post_id in expired]])
+    for post_id in expired:
+        store.execute(["zadd", TRENDING_KEY, 1e12, f"post:{post_id}"])
+
+    assert sorted(titles(client, limit=2)) == ["kept0", "kept1"]
+    assert store.execute(["zcard", TRENDING_KEY]) == 2
+
+
+def test_post_creation_trims_trending_set(client, store, create_post, monkeypatch):
+    monkeypatch.setattr("api.index.TRENDING_MAX_MEMBERS", 3)
+    for i in range(5):
+        create_post(f"p{i}")
+    assert store.execute(["zcard", TRENDING_KEY]) == 3
+    assert titles(client) == ["p4", "p3", "p2"]